@@ -0,0 +1,81 @@
+import asyncio
+import inspect
+from collections import deque
+
+
+class Actor(object):
+    """
+    Class that runs the jobs sent to it one at a time, in the order they were sent
+    Jobs of different actors run concurrently. An idle actor has no running task, so idle actors are cheap
+
+    A job must not wait for another job of its own actor, since that job only starts once the first one is done.
+
+    Attributes:
+    ----------
+    loop: `asyncio.AbstractEventLoop`
+        The loop the jobs run in
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self._mailbox = deque()
+        self._task = None
+        # Bumped by `stop`, so a cancelled run can tell it was stopped
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._mailbox)
+
+    def send(self, job) -> asyncio.Future:
+        """
+        Queues `job` and returns a future of its result
+
+        Parameters:
+        ----------
+        job: Callable[[], Any]
+            Function that runs the job. If it returns an awaitable, the job is done once the awaitable is
+        """
+
+        future = self.loop.create_future()
+        self._mailbox.append((job, future))
+        if self._task is None:
+            self._task = self.loop.create_task(self._run(self._generation))
+        return future
+
+    def stop(self) -> None:
+        """
+        Cancels the running job and every queued job
+        """
+
+        self._generation += 1
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        while self._mailbox:
+            _, future = self._mailbox.popleft()
+            future.cancel()
+
+    async def _run(self, generation: int) -> None:
+        while self._mailbox:
+            job, future = self._mailbox.popleft()
+            if future.cancelled():
+                continue
+
+            try:
+                result = job()
+                if inspect.isawaitable(result):
+                    result = await result
+            except asyncio.CancelledError:
+                future.cancel()
+                # Stopped, `stop` already forgot this task. Otherwise only the job was cancelled
+                if generation != self._generation:
+                    raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+        # Nothing is awaited since the mailbox was found empty, so no job was sent in between
+        self._task = None
@@ -0,0 +1,709 @@
+"""
+Offline benchmarks of the bots` hot paths
+
+The bot is driven through an in-memory stand-in for `discord.Client`, with synthetic servers, members and channels,
+so no discord connection is needed.
+
+Usage:
+    python benchmark.py [--members N] [--challenges N] [--submissions N] [--no-memory] [scenario ...]
+    python benchmark.py --shards N [--servers N] [--members N] [--challenges N] [--submissions N]
+
+With --shards, the submissions of --servers servers are handled by 1, 2, 4, ... up to N shard processes
+sharing the database, and the combined throughput of every shard count is reported.
+Shards only run in parallel on as many CPU cores, with fewer cores they take turns and add no throughput.
+
+Peak memory is traced with `tracemalloc`, which slows every operation down. Pass --no-memory for cleaner latencies.
+"""
+import argparse
+import asyncio
+import datetime
+import gc
+import inspect
+import itertools
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import main
+from bot import Bot
+from challenge import Event
+from db_handler import Database, database_directory
+from shards import ShardSupervisor, shard_of
+from storage import Storage
+from throttle import SlidingWindowLimiter
+
+benchmark_database = 'benchmark.db'
+
+_ids = itertools.count(100000000000000000)
+
+
+def _next_id() -> str:
+    return str(next(_ids))
+
+
+class FakeUser(object):
+    """
+    Stand-in for `discord.Member`
+    """
+
+    def __init__(self, name: str, server=None, bot=False):
+        self.id = _next_id()
+        self.name = name
+        self.display_name = name
+        self.mention = '<@{}>'.format(self.id)
+        self.bot = bot
+        self.server = server
+        self.roles = []
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeChannel(object):
+    """
+    Stand-in for `discord.Channel` and `discord.PrivateChannel`
+    """
+
+    def __init__(self, name: str, server=None):
+        self.id = _next_id()
+        self.name = name
+        self.server = server
+        self.is_private = server is None
+        self.messages = []
+
+
+class FakeMessage(object):
+    """
+    Stand-in for `discord.Message`
+    """
+
+    def __init__(self, channel: FakeChannel, author: FakeUser = None, content: str = None, embed=None):
+        self.id = _next_id()
+        self.channel = channel
+        self.server = channel.server
+        self.author = author
+        self.content = content
+        self.embed = embed
+        self.timestamp = datetime.datetime.utcnow()
+
+
+class FakeServer(object):
+    """
+    Stand-in for `discord.Server`
+    """
+
+    def __init__(self, member_count: int, server_id: str = None):
+        self.id = server_id or _next_id()
+        self.channels = [FakeChannel(name, self) for name in ('general', 'challenges', 'scoreboard', 'feed')]
+        self._members = {}
+
+        self.owner = self.add_member('owner')
+        self.owner.top_role = 'owner'
+        self.owner.roles.append('owner')
+        self.add_member('ctfbot', bot=True)
+        for i in range(member_count):
+            self.add_member('member{}'.format(i))
+
+    @property
+    def members(self):
+        return self._members.values()
+
+    def add_member(self, name: str, bot=False) -> FakeUser:
+        member = FakeUser(name, self, bot)
+        self._members[member.id] = member
+        return member
+
+    def get_member(self, member_id: str) -> FakeUser:
+        return self._members.get(member_id)
+
+
+class FakeBot(Bot):
+    """
+    `Bot` whose discord requests are answered in memory
+    Every request is counted in `calls`
+    """
+
+    def __init__(self, servers, **options):
+        super().__init__(**options)
+        self.fake_servers = {server.id: server for server in servers}
+        self.calls = {}
+
+    def _record(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    @property
+    def servers(self):
+        return self.fake_servers.values()
+
+    def get_server(self, server_id: str) -> FakeServer:
+        return self.fake_servers.get(server_id)
+
+    async def send_message(self, destination, content=None, *, tts=False, embed=None):
+        self._record('send_message')
+        message = FakeMessage(destination, content=content, embed=embed)
+        destination.messages.append(message)
+        return message
+
+    async def edit_message(self, message, new_content=None, *, embed=None):
+        self._record('edit_message')
+        message.content = new_content
+        message.embed = embed
+        return message
+
+    async def delete_message(self, message):
+        self._record('delete_message')
+        message.channel.messages.remove(message)
+
+    async def delete_messages(self, messages):
+        self._record('delete_messages')
+        for message in messages:
+            message.channel.messages.remove(message)
+
+    async def logs_from(self, channel, limit=100, *, before=None, after=None, around=None, reverse=False):
+        self._record('logs_from')
+        messages = channel.messages[::-1]
+        if before is not None:
+            messages = [message for message in messages if int(message.id) < int(before.id)]
+        for message in messages[:limit]:
+            yield message
+
+
+class Fixture(object):
+    """
+    A fake bot in a single synthetic server
+
+    Attributes:
+    ----------
+    bot: `FakeBot`
+    server: `FakeServer`
+    flags: dict[str, str]
+        Challenge name to flag
+    """
+
+    def __init__(self, loop, members: int, challenges: int, throttle=False, dynamic=False):
+        self.directory = tempfile.mkdtemp(prefix='ctfbot-benchmark-')
+        self.server = FakeServer(members)
+        self.flags = write_challenges(self.directory, self.server.id, challenges, members if dynamic else None)
+
+        remove_database()
+        self.bot = main.register_events(FakeBot([self.server], loop=loop, database_file=benchmark_database,
+                                                challenges_dir=self.directory,
+                                                snapshot_file=os.path.join(self.directory, 'ctfbot.snapshot')))
+        self.bot.board_update_delay = 0
+
+        # Synthetic load is far above the submission limits, which only the throttling scenarios exercise
+        if not throttle:
+            self.bot.member_limiter = SlidingWindowLimiter(sys.maxsize, 1.0)
+            self.bot.server_limiter = SlidingWindowLimiter(sys.maxsize, 1.0)
+
+    def members(self):
+        return [member for member in self.server.members if not member.bot]
+
+    def direct_message(self, author: FakeUser, content: str) -> FakeMessage:
+        return FakeMessage(FakeChannel('dm'), author, content)
+
+    def close(self) -> None:
+        self.bot.outbound.stop()
+        self.bot.storage.close()
+        shutil.rmtree(self.directory)
+        remove_database()
+
+
+def write_challenges(directory: str, server_id: str, count: int, dynamic_members: int = None) -> dict:
+    """
+    Writes `count` synthetic challenges to the challenge file of the server with the id `server_id`
+    and returns a dict mapping challenge name to flag
+    If `dynamic_members` is given, the challenges reach their minimum reward once a tenth of that many members
+    solved them
+    """
+
+    flags = {}
+    lines = []
+    for i in range(count):
+        name = 'challenge {}'.format(i)
+        flags[name] = 'flag{{{:032x}}}'.format(random.getrandbits(128))
+        lines.append('{}|{}|{}|Description of challenge {}|{}|{}'
+                     .format(flags[name], name, 'category{}'.format(i % 8), i, i % 5 + 1, (i % 10 + 1) * 50))
+        if dynamic_members is not None:
+            lines[-1] += '|{}|{}'.format(i % 10 + 1, max(dynamic_members // 10, 1))
+    with open(os.path.join(directory, server_id), 'w') as file:
+        file.write('\n'.join(lines))
+    return flags
+
+
+def remove_database() -> None:
+    for suffix in ('', '-wal', '-shm'):
+        p = os.path.join(database_directory, benchmark_database + suffix)
+        if os.path.exists(p):
+            os.remove(p)
+
+
+class Result(object):
+    """
+    Latencies of a single scenario
+    """
+
+    def __init__(self, name: str, latencies, total: float, peak_memory: int, note: str = None):
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.total = total
+        self.peak_memory = peak_memory
+        self.note = note
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0
+        return self.latencies[min(len(self.latencies) - 1, int(len(self.latencies) * p / 100))]
+
+    def __str__(self) -> str:
+        row = '{:<28} {:>8} {:>12.1f} {:>12.1f} {:>12.0f} {:>10.1f}'.format(
+            self.name, len(self.latencies), self.percentile(50) * 1e6, self.percentile(99) * 1e6,
+            len(self.latencies) / self.total if self.total else 0, self.peak_memory / 2 ** 20)
+        if self.note:
+            row += '\n    {}'.format(self.note)
+        return row
+
+    header = '{:<28} {:>8} {:>12} {:>12} {:>12} {:>10}'.format(
+        'scenario', 'ops', 'p50 (us)', 'p99 (us)', 'ops/s', 'peak (MB)')
+
+
+async def measure(name: str, operations, trace_memory=True) -> Result:
+    """
+    Runs and times every operation of `operations`, an iterable of functions. Returned awaitables are awaited
+    """
+
+    latencies = []
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+
+    for operation in operations:
+        before = time.perf_counter()
+        result = operation()
+        if inspect.isawaitable(result):
+            await result
+        latencies.append(time.perf_counter() - before)
+
+    total = time.perf_counter() - start
+    peak = 0
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return Result(name, latencies, total, peak)
+
+
+async def bench_load_modules(fixture: Fixture, args) -> Result:
+    return await measure('load_modules', [lambda: fixture.bot.load_modules(fixture.server)] * 5, args.memory)
+
+
+async def bench_warm_start(fixture: Fixture, args) -> Result:
+    bot = fixture.bot
+    event = bot.events[fixture.server.id]
+    members = fixture.members()
+    challenges = list(event.challenges.values())
+    for _ in range(args.submissions):
+        member = random.choice(members)
+        challenge = random.choice(challenges)
+        if event.add_points(member.id, challenge):
+            bot.save_solve(fixture.server.id, member.id, challenge)
+
+    cold = await measure('load_all_modules (cold)', [lambda: bot.load_all_modules([fixture.server])] * 5,
+                         trace_memory=False)
+    await bot.save_snapshot()
+    result = await measure('load_all_modules (snapshot)', [lambda: bot.load_all_modules([fixture.server])] * 5,
+                           args.memory)
+    result.note = 'cold start p50 {:.1f}ms'.format(cold.percentile(50) * 1000)
+    return result
+
+
+async def bench_shared_database(fixture: Fixture, args) -> Result:
+    # A second shard writing to the same database
+    storage = fixture.bot.storage
+    other = Storage(fixture.bot.loop, benchmark_database)
+    members = fixture.members()
+    names = list(fixture.flags)
+    failures = []
+
+    async def read_then_write(i):
+        read = threading.Event()
+
+        # The other shard commits between the read and the write of a batch, like it can during a snapshot
+        def read_and_yield(db):
+            db.last_solve_id()
+            read.set()
+            time.sleep(0.005)
+
+        batch = [storage.write(read_and_yield),
+                 storage.add_solve(random.choice(members).id, fixture.server.id, names[i % len(names)], 1, i)]
+        await fixture.bot.loop.run_in_executor(None, read.wait)
+        batch.append(other.add_solve(random.choice(members).id, fixture.server.id, names[i % len(names)], 1, i))
+        for result in await asyncio.gather(*batch, return_exceptions=True):
+            if isinstance(result, Exception):
+                failures.append(result)
+
+    try:
+        result = await measure('write batch (2 shards)',
+                               [lambda i=i: read_then_write(i) for i in range(100)], args.memory)
+    finally:
+        other.close()
+    assert not failures, '{} writes failed: {}'.format(len(failures), failures[0])
+    result.note = 'a batch reading before it writes never fails when another shard commits in between'
+    return result
+
+
+async def bench_check_answer(fixture: Fixture, args) -> Result:
+    event = fixture.bot.events[fixture.server.id]
+    names = list(fixture.flags)
+
+    def submit():
+        name = random.choice(names)
+        return event.check_answer(fixture.flags[name], name.replace(' ', ''))
+
+    return await measure('check_answer', [submit] * args.submissions, args.memory)
+
+
+async def bench_wrong_flag_check_answer(fixture: Fixture, args) -> Result:
+    event = fixture.bot.events[fixture.server.id]
+    names = [name.replace(' ', '') for name in fixture.flags]
+    return await measure('check_answer (wrong flags)',
+                         [lambda: event.check_answer('flag{wrong}', random.choice(names))] * args.submissions,
+                         args.memory)
+
+
+async def bench_add_points(fixture: Fixture, args) -> Result:
+    event = fixture.bot.events[fixture.server.id]
+    members = fixture.members()
+    challenges = list(event.challenges.values())
+    return await measure('add_points',
+                         [lambda: event.add_points(random.choice(members).id, random.choice(challenges))]
+                         * args.submissions, args.memory)
+
+
+async def bench_dynamic_add_points(fixture: Fixture, args) -> Result:
+    result = await bench_add_points(fixture, args)
+    result.name = 'add_points (dynamic rewards)'
+    return result
+
+
+async def bench_get_board(fixture: Fixture, args) -> Result:
+    bot = fixture.bot
+    scoreboard = bot.events[fixture.server.id].scoreboard
+    members = fixture.members()
+
+    def update_and_render():
+        scoreboard.add_score(random.choice(members).id, 50)
+        scoreboard.get_board(name_of=bot.display_names.name_of(fixture.server))
+
+    return await measure('add_score + get_board', [update_and_render] * 200, args.memory)
+
+
+async def bench_get_pages(fixture: Fixture, args) -> Result:
+    bot = fixture.bot
+    scoreboard = bot.events[fixture.server.id].scoreboard
+    members = fixture.members()
+
+    def update_and_render():
+        scoreboard.add_score(random.choice(members).id, 50)
+        scoreboard.get_pages(bot.scoreboard_rows_per_page, bot.embed_description_limit, bot.scoreboard_hide_zero,
+                             bot.scoreboard_max_pages, bot.display_names.name_of(fixture.server))
+
+    return await measure('add_score + get_pages', [update_and_render] * 200, args.memory)
+
+
+async def bench_challenge_board(fixture: Fixture, args) -> Result:
+    bot = fixture.bot
+    server_id = fixture.server.id
+    challenges = list(bot.events[server_id].challenges.values())
+    await bot.update_challenge_board(server_id)
+    posted = sum(bot.calls.values())
+
+    def change_and_update():
+        random.choice(challenges).reward += 1
+        return bot.update_challenge_board(server_id)
+
+    bot.calls.clear()
+    result = await measure('update_challenge_board', [lambda: bot.update_challenge_board(server_id)] * 20
+                           + [change_and_update] * 20, args.memory)
+    result.note = '{} requests to post {} challenges, {} requests for 20 no-op updates and 20 single changes'.format(
+        posted, len(challenges), sum(bot.calls.values()))
+    return result
+
+
+async def bench_scoreboard_at(fixture: Fixture, args) -> Result:
+    bot = fixture.bot
+    members = fixture.members()
+    names = list(fixture.flags)
+    for i in range(args.submissions):
+        bot.log_submission(fixture.server.id, random.choice(members).id, random.choice(names), i % 4 == 0, i)
+
+    return await measure('scoreboard_at', [lambda: bot.scoreboard_at(fixture.server.id,
+                                                                     random.randrange(args.submissions))] * 50,
+                         args.memory)
+
+
+async def bench_purge(fixture: Fixture, args) -> Result:
+    bot = fixture.bot
+    channel = fixture.server.channels[0]
+
+    # An eighth of the messages are too old for the bulk delete endpoint, the channel is in the order they were sent
+    old_count = args.submissions // 8
+    now = datetime.datetime.utcnow()
+    for i in range(args.submissions):
+        message = FakeMessage(channel, content=str(i))
+        age = bot.bulk_delete_max_age + datetime.timedelta(days=1) if i < old_count else datetime.timedelta(hours=1)
+        message.timestamp = now - age + datetime.timedelta(seconds=i)
+        channel.messages.append(message)
+
+    # Messages are listed 100 at a time from the newest, a page with more than one young message is deleted in bulk
+    newest_first = channel.messages[::-1]
+    pages = [newest_first[start:start + 100] for start in range(0, len(newest_first), 100)]
+    young_counts = [sum(1 for message in page if int(message.content) >= old_count) for page in pages]
+    bulk_requests = sum(1 for count in young_counts if count > 1)
+    single_requests = args.submissions - sum(count for count in young_counts if count > 1)
+
+    bot.calls.clear()
+    result = await measure('safe_delete_messages', [lambda: bot.safe_delete_messages(channel)], args.memory)
+    assert not channel.messages, '{} messages were not deleted'.format(len(channel.messages))
+    assert bot.calls.get('delete_messages', 0) == bulk_requests, \
+        '{} bulk deletes instead of {}'.format(bot.calls.get('delete_messages', 0), bulk_requests)
+    assert bot.calls.get('delete_message', 0) == single_requests, \
+        '{} single deletes instead of {}'.format(bot.calls.get('delete_message', 0), single_requests)
+    result.note = '{} messages, {} older than {} days: {} bulk and {} single deletes'.format(
+        args.submissions, old_count, bot.bulk_delete_max_age.days, bulk_requests, single_requests)
+    return result
+
+
+async def bench_save_events(fixture: Fixture, args) -> Result:
+    event = fixture.bot.events[fixture.server.id]
+    members = fixture.members()
+    challenges = list(event.challenges.values())
+    for _ in range(args.submissions):
+        event.add_points(random.choice(members).id, random.choice(challenges))
+    return await measure('save_events', [fixture.bot.save_events] * 5, args.memory)
+
+
+async def bench_wrong_flag_storm(fixture: Fixture, args) -> Result:
+    members = fixture.members()
+    names = list(fixture.flags)
+    messages = [fixture.direct_message(random.choice(members),
+                                       '{}:flag{{wrong}}#{}'.format(random.choice(names), fixture.server.id))
+                for _ in range(args.submissions)]
+    return await measure('on_message (wrong flags)',
+                         [lambda message=message: fixture.bot.on_message(message) for message in messages],
+                         args.memory)
+
+
+async def bench_correct_submissions(fixture: Fixture, args) -> Result:
+    members = fixture.members()
+    names = list(fixture.flags)
+    messages = []
+    for _ in range(args.submissions):
+        name = random.choice(names)
+        messages.append(fixture.direct_message(random.choice(members),
+                                               '{}:{}#{}'.format(name, fixture.flags[name], fixture.server.id)))
+    return await measure('on_message (correct flags)',
+                         [lambda message=message: fixture.bot.on_message(message) for message in messages],
+                         args.memory)
+
+
+async def bench_participant_memory(fixture: Fixture, args) -> Result:
+    event = Event(fixture.server.id)
+    event.load_challenges(os.path.join(fixture.directory, fixture.server.id))
+    challenges = list(event.challenges.values())
+    members = fixture.members()
+
+    # Members take part once they solve a challenge
+    def register(member):
+        for challenge in random.sample(challenges, min(10, len(challenges))):
+            event.add_points(member.id, challenge)
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = await measure('participant registration', [lambda member=member: register(member) for member in members],
+                           trace_memory=False)
+    after, result.peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result.note = '{:.0f} bytes per participant with 10 solves'.format((after - before) / len(members))
+    return result
+
+
+async def bench_brute_force_storm(fixture: Fixture, args) -> Result:
+    attacker = fixture.members()[0]
+    names = list(fixture.flags)
+    messages = [fixture.direct_message(attacker, '{}:flag{{{}}}#{}'.format(random.choice(names), i, fixture.server.id))
+                for i in range(args.submissions)]
+    return await measure('on_message (brute force)',
+                         [lambda message=message: fixture.bot.on_message(message) for message in messages],
+                         args.memory)
+
+
+scenarios = {
+    'load_modules': bench_load_modules,
+    'warm_start': bench_warm_start,
+    'shared_database': bench_shared_database,
+    'check_answer': bench_check_answer,
+    'wrong_flag_check_answer': bench_wrong_flag_check_answer,
+    'add_points': bench_add_points,
+    'dynamic_add_points': bench_dynamic_add_points,
+    'get_board': bench_get_board,
+    'get_pages': bench_get_pages,
+    'challenge_board': bench_challenge_board,
+    'scoreboard_at': bench_scoreboard_at,
+    'purge': bench_purge,
+    'save_events': bench_save_events,
+    'wrong_flag_storm': bench_wrong_flag_storm,
+    'correct_submissions': bench_correct_submissions,
+    'brute_force_storm': bench_brute_force_storm,
+    'participant_memory': bench_participant_memory,
+}
+
+# Scenarios that run with the bots` submission limits in place
+throttled_scenarios = {'brute_force_storm'}
+
+# Scenarios whose challenges lose value with every solve
+dynamic_scenarios = {'dynamic_add_points'}
+
+
+async def run(loop, args) -> None:
+    print('{} members, {} challenges, {} submissions'.format(args.members, args.challenges, args.submissions))
+    print(Result.header)
+
+    for name in args.scenarios or scenarios:
+        fixture = Fixture(loop, args.members, args.challenges, name in throttled_scenarios, name in dynamic_scenarios)
+        try:
+            await fixture.bot.load_modules(fixture.server)
+            print(await scenarios[name](fixture, args))
+        finally:
+            fixture.close()
+
+
+async def run_shard_submissions(loop, shard_id: int, shard_count: int, args, barrier) -> tuple:
+    """
+    Loads the synthetic servers of the shard `shard_id` and submits their flags once every shard is loaded
+    Returns a (latencies, start, end) tuple. A quarter of the submissions are correct
+    """
+
+    directory = tempfile.mkdtemp(prefix='ctfbot-benchmark-')
+    # The shard of a server is taken from the bits of its id above the 22nd, like discord does
+    server_ids = [str((i + 1) << 22) for i in range(args.servers)]
+    servers = [FakeServer(args.members // args.servers, server_id) for server_id in server_ids
+               if shard_of(server_id, shard_count) == shard_id]
+    flags = {server.id: write_challenges(directory, server.id, args.challenges) for server in servers}
+
+    bot = main.register_events(FakeBot(servers, loop=loop, database_file=benchmark_database, challenges_dir=directory,
+                                       stats_file=os.path.join(directory, 'ctfbot.prom'), snapshot_file=None,
+                                       shard_id=shard_id, shard_count=shard_count))
+    bot.member_limiter = SlidingWindowLimiter(sys.maxsize, 1.0)
+    bot.server_limiter = SlidingWindowLimiter(sys.maxsize, 1.0)
+
+    messages = []
+    for server in servers:
+        members = [member for member in server.members if not member.bot]
+        names = list(flags[server.id])
+        for i in range(args.submissions // args.servers):
+            name = random.choice(names)
+            flag = flags[server.id][name] if i % 4 == 0 else 'flag{wrong}'
+            messages.append(FakeMessage(FakeChannel('dm'), random.choice(members),
+                                        '{}:{}#{}'.format(name, flag, server.id)))
+    random.shuffle(messages)
+
+    try:
+        await bot.load_all_modules(servers)
+        barrier.wait(60)
+
+        latencies = []
+        start = time.time()
+        for message in messages:
+            before = time.perf_counter()
+            await bot.on_message(message)
+            latencies.append(time.perf_counter() - before)
+        return latencies, start, time.time()
+    finally:
+        bot.outbound.stop()
+        bot.storage.close()
+        shutil.rmtree(directory)
+
+
+def run_benchmark_shard(shard_id: int, shard_count: int, args, barrier, results) -> None:
+    """
+    Runs a shard of the sharded benchmark in its own process and puts its result in the queue `results`
+    """
+
+    random.seed(args.seed + shard_id)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results.put(loop.run_until_complete(run_shard_submissions(loop, shard_id, shard_count, args, barrier)))
+
+
+def run_sharded(args) -> None:
+    print('{} servers, {} members, {} challenges, {} submissions, {} CPU cores'.format(
+        args.servers, args.members, args.challenges, args.submissions, os.cpu_count()))
+    print(Result.header)
+
+    shard_counts = []
+    shard_count = 1
+    while shard_count < args.shards:
+        shard_counts.append(shard_count)
+        shard_count *= 2
+    shard_counts.append(args.shards)
+
+    # Results are sent through a manager, so a shard never waits for its result to be read before it can exit
+    manager = multiprocessing.Manager()
+    for shard_count in shard_counts:
+        remove_database()
+        with Database(benchmark_database) as db:
+            db.check_create_tables()
+            db.connection.commit()
+
+        barrier = multiprocessing.Barrier(shard_count)
+        results = manager.Queue()
+        supervisor = ShardSupervisor(run_benchmark_shard, shard_count, (args, barrier, results), max_restarts=0)
+        supervisor.run()
+
+        shard_results = [results.get() for exit_code in supervisor.exit_codes if exit_code == 0]
+        if not shard_results:
+            continue
+        latencies = [latency for shard_latencies, _, _ in shard_results for latency in shard_latencies]
+        total = max(end for _, _, end in shard_results) - min(start for _, start, _ in shard_results)
+        print(Result('on_message ({} shards)'.format(shard_count), latencies, total, 0))
+
+    manager.shutdown()
+    remove_database()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the bot against a fake discord client')
+    parser.add_argument('--shards', type=int, help='run the sharded benchmark with up to this many shards')
+    parser.add_argument('--servers', type=int, default=8, help='number of servers of the sharded benchmark')
+    parser.add_argument('--members', type=int, default=10000)
+    parser.add_argument('--challenges', type=int, default=500)
+    parser.add_argument('--submissions', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='do not trace peak memory')
+    parser.add_argument('scenarios', nargs='*', help='any of: {}'.format(', '.join(scenarios)))
+    args = parser.parse_args()
+
+    for scenario in args.scenarios:
+        if scenario not in scenarios:
+            parser.error('unknown scenario {}'.format(scenario))
+
+    random.seed(args.seed)
+    if args.shards:
+        run_sharded(args)
+        sys.exit()
+
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    event_loop.run_until_complete(run(event_loop, args))
@@ -0,0 +1,151 @@
+import discord
+
+from challenge import Challenge, challenge_digest
+
+board_color = 0x3296d5
+
+
+def challenge_embed(challenge: Challenge) -> discord.Embed:
+    """
+    Returns the embed displaying `challenge` in a message of its own
+    """
+
+    embed = discord.Embed(title=challenge.name, description=challenge.description, color=board_color)
+    embed.add_field(name='Difficulty', value=':triangular_flag_on_post:' * challenge.difficulty, inline=True)
+    embed.add_field(name='Reward', value='{} points'.format(challenge.reward), inline=True)
+    embed.add_field(name='Category', value=challenge.category, inline=True)
+    return embed
+
+
+def challenge_field(challenge: Challenge) -> tuple:
+    """
+    Returns a (name, value) tuple of the embed field displaying `challenge` in a message shared with
+    other challenges of its category
+    """
+
+    value = '{} points {}'.format(challenge.reward, ':triangular_flag_on_post:' * challenge.difficulty)
+    if challenge.description:
+        value += '\n' + challenge.description
+    return challenge.name, value
+
+
+class ChallengeBoard(object):
+    """
+    Class that lays out the challenge board of a server and remembers the messages posted for it,
+    so an update only edits the messages whose challenges changed
+    Challenges with a short description are shown as fields of a message shared with the other short challenges
+    of their category, other challenges get a message of their own.
+    Every challenge is rendered once for each version of its content, see `challenge_digest`
+
+    Attributes:
+    ----------
+    group_size: int
+        Maximum number of challenges shown in a shared message. Discord allows 25 fields in an embed
+    short_description_length: int
+        Maximum length of the description of a challenge shown in a shared message.
+        Discord allows 1024 characters in a field
+    posted: dict
+        Messages of the board
+        Key is the key of the message, see `layout`
+        Value is a (digests, message) tuple of the digests of the challenges the message shows and the message
+    """
+
+    def __init__(self, group_size: int = 8, short_description_length: int = 200):
+        self.group_size = group_size
+        self.short_description_length = short_description_length
+        self.posted = {}
+        # Key is challenge name, value is a (digest, embed or field) tuple
+        self._rendered = {}
+
+    def is_short(self, challenge: Challenge) -> bool:
+        return len(challenge.description) <= self.short_description_length
+
+    def render(self, challenge: Challenge) -> tuple:
+        """
+        Returns a (digest, rendered) tuple of `challenge`, where rendered is its `challenge_field` if it is short
+        and its `challenge_embed` otherwise. Challenges are only rendered again once their content changes
+        """
+
+        digest = challenge_digest(challenge)
+        rendered = self._rendered.get(challenge.name)
+        if rendered is None or rendered[0] != digest:
+            rendered = self._rendered[challenge.name] = \
+                (digest, challenge_field(challenge) if self.is_short(challenge) else challenge_embed(challenge))
+        return rendered
+
+    def layout(self, challenges) -> dict:
+        """
+        Returns a dict mapping the key of every message of the board to the list of challenges it shows,
+        in the order of `challenges`
+        A challenge with a message of its own is keyed ('challenge', name), a shared message is keyed
+        ('category', category, index), so a change in a category leaves the messages of other categories alone
+
+        Parameters:
+        ----------
+        challenges: Iterable[Challenge]
+            The challenges of the event
+        """
+
+        layout = {}
+        group_sizes = {}
+        for challenge in challenges:
+            if self.is_short(challenge):
+                size = group_sizes.get(challenge.category, 0)
+                group_sizes[challenge.category] = size + 1
+                layout.setdefault(('category', challenge.category, size // self.group_size), []).append(challenge)
+            else:
+                layout[('challenge', challenge.name)] = [challenge]
+        return layout
+
+    @staticmethod
+    def create_embed(key: tuple, rendered: list) -> discord.Embed:
+        """
+        Returns the embed of the message `key` of the layout, from the `render` of its challenges
+        """
+
+        if key[0] == 'challenge':
+            return rendered[0]
+
+        _, category, index = key
+        embed = discord.Embed(title=category if not index else '{} ({})'.format(category, index + 1),
+                              color=board_color)
+        for name, value in rendered:
+            embed.add_field(name=name, value=value, inline=False)
+        return embed
+
+    def diff(self, challenges):
+        """
+        Lays out `challenges` and forgets the messages that are no longer part of the board
+        Returns a (removed, changed) tuple. `removed` is the list of messages to delete, `changed` is a list of
+        (key, digests, embed, message) tuples of the messages to edit, where message is None if it is yet to be posted
+        Once a message is edited or posted, it is stored with `set_posted`
+
+        Parameters:
+        ----------
+        challenges: Iterable[Challenge]
+            The challenges of the event
+        """
+
+        layout = self.layout(challenges)
+
+        names = {challenge.name for shown in layout.values() for challenge in shown}
+        for name in [name for name in self._rendered if name not in names]:
+            del self._rendered[name]
+
+        removed = [self.posted.pop(key)[1] for key in [key for key in self.posted if key not in layout]]
+
+        changed = []
+        for key, shown in layout.items():
+            rendered = [self.render(challenge) for challenge in shown]
+            digests = tuple(digest for digest, _ in rendered)
+            old_digests, message = self.posted.get(key, (None, None))
+            if digests != old_digests:
+                changed.append((key, digests, self.create_embed(key, [item for _, item in rendered]), message))
+        return removed, changed
+
+    def set_posted(self, key: tuple, digests: tuple, message: discord.Message) -> None:
+        """
+        Stores `message` as the message of `key`, showing the challenges with the digests `digests`
+        """
+
+        self.posted[key] = (digests, message)
@@ -1,11 +1,25 @@
+import asyncio
+import datetime
 import discord
-from challenge import Event, Challenge
+import time
+from actor import Actor
+from board import ChallengeBoard
+from challenge import Event, Challenge, Scoreboard, SolveHistory, challenge_fields, challenge_scoring, parse_challenges
 
-from os import path
+from os import path, stat
 
-from db_handler import Database
+from storage import Storage
+from scheduler import OutboundScheduler, PRIORITY_FEED, PRIORITY_BOARD
+from names import DisplayNames
+from routing import ChannelRouter, load_channel_names
+from snapshot import read_snapshot, write_snapshot
+from stats import Stats
+from throttle import SlidingWindowLimiter
 
 challenges_dir = path.join(path.dirname(path.abspath(__file__)), 'challenges')
+stats_file = path.join(path.dirname(path.abspath(__file__)), 'ctfbot.prom')
+snapshot_file = path.join(path.dirname(path.abspath(__file__)), 'ctfbot.snapshot')
+channel_names_file = path.join(path.dirname(path.abspath(__file__)), 'channel_names.json')
 
 
 class Bot(discord.Client):
@@ -16,37 +30,504 @@ class Bot(discord.Client):
     events: dict
         Key is server id
         Value is `Event` god-object
+    actors: dict
+        Key is server id
+        Value is the `Actor` every change to the event of the server goes through, see `actor`
+    storage: `Storage`
+        Runs every read and write of the bots` database off the event loop
+    challenges_dir: str
+        Directory of the challenge files, each named after the id of its server
+    stats: `Stats`
+        Latency histograms and counters of every server
+    stats_file: str
+        File the statistics are exported to in the Prometheus text format, every `stats_export_interval` seconds
+    snapshot_file: str
+        File the state of every event is saved to every `snapshot_interval` seconds and on shutdown,
+        so a restart only reads the solves saved after it. None to always load from the database
+    routes: `ChannelRouter`
+        The challenges, scoreboard and feed channels of every server, with the channel names of
+        the optional `channel_names_file`
+    display_names: `DisplayNames`
+        Display names of the members shown in the scoreboards, at most `display_name_cache_size` of them
+    member_limiter: `SlidingWindowLimiter`
+        Limits the number of private messages handled for each member
+    server_limiter: `SlidingWindowLimiter`
+        Limits the number of flag submissions checked for each server
+    challenge_watch_interval: float
+        Number of seconds between checks of the challenge files for changes
+    board_messages: dict
+        Messages the bot posted to the boards of each server, so they can be edited in place
+        Key is server id
+        Value is a dict with the `scoreboard` list of (page, message) tuples, the challenge board `header` message
+        and the `challenges` `ChallengeBoard`
+    board_update_delay: float
+        Number of seconds board updates requested with `schedule_board_update` are held back,
+        so a burst of solves results in a single update
+    embed_description_limit: int
+        Maximum number of characters discord accepts in the description of an embed
+    scoreboard_rows_per_page: int
+        Maximum number of members shown in each scoreboard message
+    scoreboard_max_pages: int
+        Maximum number of scoreboard messages, lower ranked members are not shown
+    scoreboard_hide_zero: bool
+        Whether members without points are left out of the scoreboard
+    challenge_group_size: int
+        Maximum number of challenges with a short description shown in a single challenge board message
+    short_description_length: int
+        Maximum length of the description of a challenge that shares its challenge board message
+    bulk_delete_max_age: `datetime.timedelta`
+        Age from which discord refuses to bulk delete messages
+    purge_workers: int
+        Number of concurrent single message deletes used by `safe_delete_messages`
+    outbound: `OutboundScheduler`
+        Paces and prioritizes the messages the bot sends, edits and deletes
 
     """
 
-    def __init__(self, **options):
+    board_update_delay = 2.0
+    embed_description_limit = 2048
+    scoreboard_rows_per_page = 25
+    scoreboard_max_pages = 10
+    scoreboard_hide_zero = True
+    challenge_group_size = 8
+    short_description_length = 200
+    bulk_delete_max_age = datetime.timedelta(days=14)
+    purge_workers = 4
+    stats_export_interval = 15.0
+    member_submission_limit = (5, 10.0)
+    server_submission_limit = (50, 1.0)
+    challenge_watch_interval = 2.0
+    snapshot_interval = 300.0
+    display_name_cache_size = 4096
+
+    def __init__(self, database_file='ctfbot.db', challenges_dir=challenges_dir, stats_file=stats_file,
+                 snapshot_file=snapshot_file, channel_names_file=channel_names_file, **options):
         super().__init__(**options)
 
+        self.challenges_dir = challenges_dir
+        self.stats = Stats()
+        self.stats_file = stats_file
+        self._stats_exporter = None
+
+        self.member_limiter = SlidingWindowLimiter(*self.member_submission_limit)
+        self.server_limiter = SlidingWindowLimiter(*self.server_submission_limit)
+
+        self._challenge_stamps = {}
+        # Stamps of changed challenge files that are yet to be applied, keyed by server id
+        self._changed_stamps = {}
+        self._challenge_watcher = None
+
+        self.snapshot_file = snapshot_file
+        self._snapshotter = None
+
+        self.routes = ChannelRouter(load_channel_names(channel_names_file))
+        self.display_names = DisplayNames(self.display_name_cache_size)
+        self.solve_histories = {}
+
         self.events = {}
+        self.actors = {}
+        self.board_messages = {}
+        self.outbound = OutboundScheduler(self.loop)
+
+        self._pending_board_updates = {}
+        self._board_locks = {}
+
+        self.storage = Storage(self.loop, database_file)
+
+    async def close(self) -> None:
+        """
+        Closes the discord connection, saves a snapshot of the events and closes the database connections
+        """
+
+        self.outbound.stop()
+        for actor in self.actors.values():
+            actor.stop()
+        for task in (self._stats_exporter, self._challenge_watcher, self._snapshotter):
+            if task is not None:
+                task.cancel()
+        await super().close()
+        if self._snapshotter is not None:
+            try:
+                await self.save_snapshot()
+            except OSError as e:
+                print(e)
+        self.storage.close()
+
+    def start_stats_export(self) -> None:
+        """
+        Starts exporting `self.stats` to `self.stats_file` periodically, unless it is already being exported
+        """
+
+        if self._stats_exporter is None:
+            self._stats_exporter = self.loop.create_task(self.__export_stats())
+
+    async def __export_stats(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_export_interval)
+            try:
+                self.stats.export_prometheus(self.stats_file)
+            except OSError as e:
+                print(e)
+
+    def start_snapshots(self) -> None:
+        """
+        Starts saving a snapshot of the events to `self.snapshot_file` periodically, unless it is already being saved
+        The first snapshot is saved right away, so it accounts for the solves pruned while loading
+        """
+
+        if self._snapshotter is None and self.snapshot_file is not None:
+            self._snapshotter = self.loop.create_task(self.__save_snapshots())
+
+    async def __save_snapshots(self) -> None:
+        while True:
+            try:
+                await self.save_snapshot()
+            except OSError as e:
+                print(e)
+            await asyncio.sleep(self.snapshot_interval)
+
+    async def save_snapshot(self) -> None:
+        """
+        Saves the state of every event to `self.snapshot_file`, stamped with the stamp of its challenge file
+        and the id of the newest saved solve
+        """
+
+        if self.snapshot_file is None:
+            return
+
+        with self.stats.timer(self.stats.global_server_id, 'snapshot_capture'):
+            events = {server_id: {'stamp': self._challenge_stamps.get(server_id), 'event': event.snapshot()}
+                      for server_id, event in self.events.items()}
+
+        # A solve is queued for saving as soon as it is scored, and writes are committed in order,
+        # so every solve up to this id is part of the captured state
+        last_solve_id = await self.storage.write(lambda db: db.last_solve_id())
+        await self.loop.run_in_executor(None, write_snapshot, self.snapshot_file, last_solve_id, events)
+
+    def start_challenge_watch(self) -> None:
+        """
+        Starts watching the challenge files of every loaded server, unless they are already watched
+        A changed file is applied with `reload_challenges` once it stayed the same for two checks in a row,
+        so a file that is still being written is not applied
+        """
+
+        if self._challenge_watcher is None:
+            self._challenge_watcher = self.loop.create_task(self.__watch_challenges())
+
+    def __challenge_file_stamp(self, server_id: str):
+        """
+        Returns a value that changes whenever the challenge file of the server with the id `server_id` changes,
+        or None if there is no such file
+        """
+
+        try:
+            st = stat(path.join(self.challenges_dir, server_id))
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    async def __watch_challenges(self) -> None:
+        while True:
+            await asyncio.sleep(self.challenge_watch_interval)
+
+            for server_id in list(self.events):
+                stamp = self.__challenge_file_stamp(server_id)
+                if stamp is None or stamp == self._challenge_stamps.get(server_id):
+                    self._changed_stamps.pop(server_id, None)
+                elif self._changed_stamps.get(server_id) != stamp:
+                    self._changed_stamps[server_id] = stamp
+                else:
+                    del self._changed_stamps[server_id]
+                    self._challenge_stamps[server_id] = stamp
+                    # A server that fails to reload must not stop the watcher of every other server
+                    try:
+                        await self.actor(server_id).send(lambda server_id=server_id:
+                                                         self.reload_challenges(server_id))
+                    except Exception as e:
+                        print(e)
+
+    def actor(self, server_id: str) -> Actor:
+        """
+        Returns the actor of the server with the id `server_id`
+        Changes to the event of a server are sent to its actor, so they never interleave,
+        while the changes of different servers run concurrently
+        """
+
+        actor = self.actors.get(server_id)
+        if actor is None:
+            actor = self.actors[server_id] = Actor(self.loop)
+        return actor
+
+    def judge_submission(self, server_id: str, member, flag: str, challenge_name: str = None):
+        """
+        Checks a flag submitted by `member` to the server with the id `server_id`, scores it and queues it for saving
+        Meant to run in the actor of the server
+        Returns a (challenge, solved, saved) tuple. `challenge` is the challenge of the flag or None if it is wrong,
+        `solved` is True if the member did not solve the challenge before,
+        and `saved` is a future that is resolved once the solve is stored, or None if nothing was solved
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server the flag was submitted to
+        member: `discord.User`
+            The member who submitted the flag
+        flag: str
+            The submitted flag
+        challenge_name: str
+            Name of the challenge the flag was submitted to, see `Event.check_answer`
+        """
+
+        event = self.events[server_id]
+        with self.stats.timer(server_id, 'check_answer'):
+            challenge = event.check_answer(flag, challenge_name)
+
+        submitted_at = time.time()
+        self.log_submission(server_id, member.id, challenge.name if challenge else challenge_name, bool(challenge),
+                            submitted_at)
+
+        solved = False
+        saved = None
+        if challenge:
+            reward = challenge.reward
+            with self.stats.timer(server_id, 'add_points'):
+                solved = event.add_points(member.id, challenge, submitted_at)
+            if solved:
+                self.stats.increment(server_id, 'solves')
+                saved = self.save_solve(server_id, member.id, challenge, submitted_at, challenge.reward - reward)
+                saved.add_done_callback(lambda future: self.__revert_unsaved_solve(future, server_id, member.id,
+                                                                                   challenge, submitted_at))
+                # The challenge board shows the new value of a dynamic challenge
+                if challenge.reward != reward:
+                    self.schedule_board_update(server_id, 'challenge')
+        else:
+            self.stats.increment(server_id, 'wrong_flags')
+        return challenge, solved, saved
+
+    def __revert_unsaved_solve(self, saved: asyncio.Future, server_id: str, member_id: str, challenge: Challenge,
+                               solved_at: float) -> None:
+        """
+        Internal method that undoes a solve in the event once saving it failed, so the member can submit it again
+        The undo runs in the actor of the server, before any submission that comes after it
+        """
+
+        if saved.cancelled() or saved.exception() is None:
+            return
+
+        def revert():
+            event = self.events.get(server_id)
+            reward = challenge.reward
+            if event is not None and event.remove_solve(member_id, challenge, solved_at):
+                self.stats.increment(server_id, 'unsaved_solves')
+                if challenge.reward != reward:
+                    self.schedule_board_update(server_id, 'challenge')
+
+        self.actor(server_id).send(revert)
+
+    def publish_solve(self, server_id: str, challenge: Challenge, member) -> asyncio.Task:
+        """
+        Updates the scoreboard and the answer feed of the server after `member` solved `challenge`
+        Runs as a task of its own, so the solver is answered without waiting for the boards
+        """
+
+        async def publish():
+            self.schedule_board_update(server_id, 'score')
+            await self.update_answer_feed(server_id, challenge, member)
+
+        return self.loop.create_task(publish())
+
+    async def reload_challenges(self, server_id: str) -> None:
+        """
+        Applies the challenge file of the server with the id `server_id` to its event
+        Only the challenges that were added, removed or changed are touched, only members who solved a removed
+        challenge or one whose reward changed are rescored, and only the boards that changed are updated
+        Raises ValueError and leaves the event as it is if any line of the file is invalid.
+        The stored solves and scores are read and rebuilt before the event is touched, so an error of the database
+        also leaves the event as it is
+
+        The stored solves of removed challenges are kept, so a challenge that comes back, e.g. after a typo in the
+        file is fixed, gets its solves back. They are pruned by `load_modules` and on startup
+        """
+
+        # The challenges of a server the bot left are read again by `load_modules` once it joins back
+        server = self.get_server(server_id)
+        if server is None:
+            return
+
+        event = self.events[server_id]
+        challenges = parse_challenges(path.join(self.challenges_dir, server_id), strict=True)
+
+        added, removed, changed = event.diff_challenges(challenges)
+        if not (added or removed or changed):
+            return
+
+        solves = []
+        if added:
+            solves = await self.storage.read(lambda db: db.load_challenge_solves(server_id, added))
+        scoring = {name: challenge_scoring(challenge) for name, challenge in challenges.items()}
+        await self.storage.write(lambda db: db.ensure_scores(server_id, scoring))
+
+        (added, removed, changed), affected = event.apply_challenges(challenges)
+        for member_id, challenge_name, solved_at in solves:
+            if server.get_member(member_id) is not None and event.mark_solved(member_id, challenge_name, solved_at):
+                affected.add(member_id)
+        if solves:
+            event.update_rewards()
+
+        print('Reloaded the challenges of {}: {} added, {} removed, {} changed, {} members rescored'
+              .format(server_id, len(added), len(removed), len(changed), len(affected)))
+
+        for member_id in affected:
+            if member_id in event.scoreboard:
+                event.scoreboard.set_score(member_id, self.compute_score_user(server_id, member_id))
+            elif member_id in event.solves:
+                event.scoreboard.add_score(member_id, self.compute_score_user(server_id, member_id))
+
+        self.schedule_board_update(server_id, 'challenge')
+        if affected:
+            self.schedule_board_update(server_id, 'score')
 
     async def load_modules(self, server):
         """
         Initialize everything required for the bots` functionality in the discord server `server`
         """
 
-        # Creates self.events[server.id]
-        self.__create_event(server)
+        event = self.__create_event(server)
+        self.routes.resolve(server)
+
+        members = list(server.members)
+        challenges = list(event.challenges)
+        scoring = event.scoring()
+        self.storage.write(lambda db: db.remove_redundancies(server.id, members, challenges))
+        await self.storage.write(lambda db: db.ensure_scores(server.id, scoring))
+
+        def load(db):
+            db.load_solved({server.id: event}, server.id)
+            return db.load_scores(server.id)
+
+        scores = await self.storage.read(load)
+        event.update_rewards()
+
+        # The event is only published once it is fully loaded
+        self.events[server.id] = event
+        self.apply_scores(server.id, scores)
+
+    async def load_all_modules(self, servers) -> None:
+        """
+        Initialize everything required for the bots` functionality in every server of `servers`
+        Servers whose challenge file did not change since the last snapshot are restored from it,
+        and only the solves saved after the snapshot are read from the database.
+        The solved challenges of the other servers are read from the database at once
+
+        Parameters:
+        ----------
+        servers: Iterable[discord.Server]
+            The servers to load
+        """
 
-        # Initialize the scoreboard participant list
-        for member in server.members:
-            if not member.bot:
-                self.events[server.id].scoreboard.add_participant(member)
+        servers = list(servers)
+        events = {}
+        restored = {}
+
+        snapshot = None if self.snapshot_file is None else read_snapshot(self.snapshot_file)
+        last_solve_id, states = snapshot if snapshot is not None else (0, {})
+
+        for server in servers:
+            self.routes.resolve(server)
+            state = states.get(server.id)
+            if state is not None and state['stamp'] == self.__challenge_file_stamp(server.id):
+                event = self.__restore_event(server, state)
+                restored[server.id] = event
+            else:
+                event = self.__create_event(server)
+            events[server.id] = event
+            self.storage.write(lambda db, server_id=server.id, members=list(server.members),
+                               challenges=list(event.challenges):
+                               db.remove_redundancies(server_id, members, challenges))
+            # Pruning solves invalidates the scores of servers with dynamic challenges, restored ones too
+            self.storage.write(lambda db, server_id=server.id, scoring=event.scoring():
+                               db.ensure_scores(server_id, scoring))
+
+        # Writes are committed in order, so once this read starts every write above is done
+        await self.storage.write(lambda db: None)
+
+        cold = {server_id: event for server_id, event in events.items() if server_id not in restored}
+
+        def load(db):
+            if restored:
+                for server_id in cold:
+                    db.load_solved(cold, server_id)
+            else:
+                db.load_all_solved(cold)
+            scores = {server_id: db.load_scores(server_id) for server_id in cold}
+            solves = db.load_solves_since(last_solve_id, restored) if restored else []
+            return scores, solves
+
+        scores, solves = await self.storage.read(load)
+
+        self.events.update(events)
+        for server_id in cold:
+            events[server_id].update_rewards()
+            self.apply_scores(server_id, scores[server_id])
+
+        replayed = 0
+        for server_id, user_id, challenge_name, solved_at in solves:
+            # Solves of members who left were pruned from the database
+            if server_id in restored and self.get_server(server_id).get_member(user_id) is not None:
+                if restored[server_id].replay_solve(user_id, challenge_name, solved_at):
+                    replayed += 1
+
+        if restored:
+            print('Restored {} servers from the snapshot, replayed {} solves'.format(len(restored), replayed))
+
+    def refresh_channels(self, server) -> None:
+        """
+        Resolves the board channels of `server` again. Called whenever a channel of the server is created,
+        deleted or changed
+        A board that moved to another channel is posted again in its new channel
+        """
 
-        with Database() as db:
-            db.check_create_tables()
-            db.remove_redundancies(server.members, self.events[server.id].challenges)
-            db.load_solved(self.events, server.id)
+        old_routes = self.routes.invalidate(server.id)
+        routes = self.routes.resolve(server)
+        if server.id not in self.events:
+            return
+
+        messages = self.board_messages.get(server.id, {})
+        if routes.get('challenges') is not old_routes.get('challenges'):
+            messages.pop('header', None)
+            messages.pop('challenges', None)
+            self.schedule_board_update(server.id, 'challenge')
+        if routes.get('scoreboard') is not old_routes.get('scoreboard'):
+            messages.pop('scoreboard', None)
+            self.schedule_board_update(server.id, 'score')
+
+    async def publish_boards(self, server_id: str) -> None:
+        """
+        Updates the challenge board and the scoreboard of the server with the id `server_id`
+        """
+
+        await self.update_challenge_board(server_id)
+        await self.update_score_board(server_id)
+
+    async def publish_all_boards(self, servers, parallelism: int = 8) -> None:
+        """
+        Updates the boards of every server of `servers`, at most `parallelism` servers at a time
+        """
+
+        semaphore = asyncio.Semaphore(parallelism)
+
+        async def publish(server_id):
+            async with semaphore:
+                try:
+                    await self.publish_boards(server_id)
+                except discord.HTTPException as e:
+                    print(e)
 
-        self.compute_scores_servers()
+        await asyncio.gather(*[publish(server.id) for server in servers])
 
-    def __create_event(self, server: discord.Server) -> None:
+    def __create_event(self, server: discord.Server) -> Event:
         """
-        Internal method to load a single event object
+        Internal method to create a single event object
 
         Parameters:
         ----------
@@ -56,14 +537,41 @@ class Bot(discord.Client):
 
         event = Event(server.id)
 
-        challenge_p = path.join(challenges_dir, server.id)
+        challenge_p = path.join(self.challenges_dir, server.id)
+        self._challenge_stamps[server.id] = self.__challenge_file_stamp(server.id)
         if path.exists(challenge_p):
             event.load_challenges(challenge_p)
 
-        for member in server.members:
-            event.scoreboard.add_participant(member)
+        return event
 
-        self.events[server.id] = event
+    def __restore_event(self, server: discord.Server, state: dict) -> Event:
+        """
+        Internal method to restore a single event object from a snapshot
+
+        Parameters:
+        ----------
+        server: `discord.Server`:
+            Server to load the object for
+        state: dict
+            The snapshot of the server, see `save_snapshot`
+        """
+
+        event = Event.restore(server.id, state['event'])
+        self._challenge_stamps[server.id] = state['stamp']
+
+        event.scoreboard.add_participants(entry for entry in state['event']['scores']
+                                          if server.get_member(entry[0]) is not None)
+
+        # Solves of members who left are pruned from the database as well
+        for member_id in [member_id for member_id in event.solves if server.get_member(member_id) is None]:
+            event.forget_member(member_id)
+
+        # Which may lower the solve count of dynamic challenges, and so raise the score of their other solvers
+        for challenge in event.challenges.values():
+            if challenge.dynamic:
+                event.change_reward(challenge, challenge.value(len(event.solvers.get(challenge.id, ()))))
+
+        return event
 
     def compute_score_user(self, server_id, user_id) -> int:
         """
@@ -71,40 +579,169 @@ class Bot(discord.Client):
 
         """
 
-        score = 0
+        return self.events[server_id].compute_score(user_id)
+
+    def apply_scores(self, server_id: str, scores) -> None:
+        """
+        Writes `scores` to the scoreboard of the server with the id `server_id`
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server
+        scores: Iterable[tuple]
+            (user id, score, last solve timestamp) tuples, as returned by `Database.load_scores`
+        """
+
+        server = self.get_server(server_id)
+        scoreboard = self.events[server_id].scoreboard
+
+        # New participants are added at once, so loading a server sorts its scoreboard a single time
+        entries = []
+        for user_id, score, last_solve_at in scores:
+            if server.get_member(user_id) is None:
+                continue
+            if user_id in scoreboard:
+                scoreboard.set_score(user_id, score, last_solve_at)
+            else:
+                entries.append((user_id, score, last_solve_at))
+        scoreboard.add_participants(entries)
+
+    async def rebuild_scores(self, server_id: str) -> int:
+        """
+        Rebuilds the stored scores of the server with the id `server_id` from its solved challenges
+        and writes them to its scoreboard
+        Returns the number of members whose score in the scoreboard was different
+        """
+
+        event = self.events[server_id]
+        scoring = event.scoring()
+        await self.storage.write(lambda db: db.rebuild_scores(server_id, scoring))
+        scores = await self.storage.read(lambda db: db.load_scores(server_id))
+
+        stored = {user_id: score for user_id, score, _ in scores}
+        mismatches = 0
+        for member_id, score in event.scoreboard.top():
+            if score != stored.get(member_id, 0):
+                mismatches += 1
+                if member_id not in stored:
+                    event.scoreboard.remove(member_id)
+
+        self.apply_scores(server_id, scores)
+        return mismatches
+
+    async def scoreboard_at(self, server_id: str, until: float) -> Scoreboard:
+        """
+        Returns the scoreboard of the server with the id `server_id` as it was at the time `until`,
+        computed from the submission log with the current challenges. Dynamic challenges are worth what they were
+        worth at that time
+        Only the submissions logged since the previous call are read, see `SolveHistory`
+        """
+
+        history = self.solve_histories.get(server_id)
+        if history is None:
+            history = self.solve_histories[server_id] = SolveHistory()
+
+        # Submissions are logged without waiting, so wait for every queued write to be committed
+        await self.storage.write(lambda db: None)
+        submissions = await self.storage.read(lambda db, after_id=history.last_id: db.load_solve_log(server_id,
+                                                                                                        after_id))
+        history.extend(submissions)
+        scores = history.scores_at(until, self.events[server_id].challenges)
 
-        # for every solved challenge
-        for solved_challenge_name in self.events[server_id].solves[user_id]:
-            score += self.events[server_id].challenges[solved_challenge_name].reward
+        server = self.get_server(server_id)
+        entries = [(user_id, score, last_solve_at) for user_id, score, last_solve_at in scores
+                   if server.get_member(user_id) is not None]
 
-        return score
+        scoreboard = Scoreboard()
+        scoreboard.add_participants(entries)
+        return scoreboard
 
-    def compute_scores_servers(self) -> None:
+    async def replay_event(self, server_id: str, until: float = None) -> Event:
         """
-        Compute scores of all servers
+        Returns a new event of the server with the id `server_id` rebuilt by replaying its submission log,
+        with the current challenges. If `until` is given, only the submissions made up to that time are replayed
         """
 
-        # for each server
-        for server_id in self.events:
-            # for each user in the server
-            for user_id in self.events[server_id].solves:
-                self.events[server_id].scoreboard.participants[self.get_server(server_id).get_member(user_id)] = self.compute_score_user(server_id, user_id)
+        server = self.get_server(server_id)
+        event = Event(server_id)
+        event.apply_challenges({name: Challenge(*challenge_fields(challenge))
+                                for name, challenge in self.events[server_id].challenges.items()})
+        await self.storage.write(lambda db: None)
+        submissions = await self.storage.read(lambda db: db.load_submissions(server_id, until, correct_only=True))
+        for user_id, challenge_name, _, submitted_at in submissions:
+            if server.get_member(user_id) is not None:
+                event.replay_solve(user_id, challenge_name, submitted_at)
+        return event
+
+    def log_submission(self, server_id: str, member_id: str, challenge_name: str, correct: bool,
+                       submitted_at: float = None) -> asyncio.Future:
+        """
+        Appends a checked flag to the submission log of the server
+        Returns a future that is resolved once the submission is committed
 
-    def save_events(self) -> None:
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server the flag was submitted to
+        member_id: str
+            ID of the member who submitted the flag
+        challenge_name: str
+            Name of the challenge the flag was submitted to, None if it was not named and the flag matched none
+        correct: bool
+            Whether the flag was correct
+        submitted_at: float
+            Timestamp of the submission. Defaults to now
+        """
+
+        return self.storage.log_submission(server_id, member_id, challenge_name, correct,
+                                           time.time() if submitted_at is None else submitted_at)
+
+    async def save_events(self) -> None:
         """
         Saves the solved challenges to the database
         """
 
-        with Database() as db:
-            for event in self.events.values():
-                db.save_solved_challenges(event.solves, event.server_id)
+        saves = []
+        for event in self.events.values():
+            solves = {member_id: [challenge.name for challenge in event.solved_challenges(member_id)]
+                      for member_id in event.solves}
+            saves.append(self.storage.write(lambda db, solves=solves, server_id=event.server_id:
+                                            db.save_solved_challenges(solves, server_id)))
+        await asyncio.gather(*saves)
+
+    def save_solve(self, server_id: str, member_id: str, challenge: Challenge,
+                   solved_at: float = None, reward_change: int = 0) -> asyncio.Future:
+        """
+        Saves a single solved challenge to the database.
+        This method is called whenever a user successfully completes a challenge
+        Returns a future that is resolved once the solve is committed
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server the challenge belongs to
+        member_id: str
+            ID of the member who solved the challenge
+        challenge: `Challenge`
+            The challenge that was completed
+        solved_at: float
+            Timestamp of the solve. Defaults to now
+        reward_change: int
+            Change of the reward of `challenge` caused by the solve, if it is a dynamic challenge
+        """
+
+        return self.storage.add_solve(member_id, server_id, challenge.name, challenge.reward,
+                                      time.time() if solved_at is None else solved_at, reward_change)
 
-    async def safe_delete_messages(self, channel: discord.Channel) -> None:
+    async def safe_delete_messages(self, channel: discord.Channel) -> int:
         """
-        Deletes all messages from the channel `channel`
+        Deletes all messages from the channel `channel` and returns how many messages were deleted
 
         This function is useful because `discord.Client.purge_from` fails to delete messages older than 14 days,
         and it has a limit of 100 messages
+        Messages young enough for the bulk delete endpoint are deleted 100 at a time, older messages are
+        deleted one by one by `purge_workers` concurrent workers
 
         Parameters:
         ----------
@@ -112,66 +749,236 @@ class Bot(discord.Client):
             Channel do delete messages from
         """
 
-        more_messages = True
+        start = time.monotonic()
+        counts = {'bulk': 0, 'single': 0}
+
+        # Leave a margin so messages do not age past the limit between listing and deleting them
+        cutoff = datetime.datetime.utcnow() - self.bulk_delete_max_age + datetime.timedelta(minutes=5)
+
+        old_messages = asyncio.Queue()
+        workers = [self.loop.create_task(self.__delete_worker(old_messages, counts))
+                   for _ in range(self.purge_workers)]
+
+        try:
+            before = None
+            more_messages = True
+
+            while more_messages:
+                page = []
+                async for message in self.logs_from(channel, limit=100, before=before):
+                    page.append(message)
+
+                more_messages = len(page) > 0
+                if not more_messages:
+                    break
+                before = page[-1]
+
+                recent = [message for message in page if message.timestamp > cutoff]
+                for message in page:
+                    if message.timestamp <= cutoff:
+                        old_messages.put_nowait(message)
+
+                if len(recent) > 1:
+                    try:
+                        await self.delete_messages(recent)
+                        counts['bulk'] += len(recent)
+                        recent = []
+                    except discord.HTTPException as e:
+                        print(e)
+                for message in recent:
+                    old_messages.put_nowait(message)
+
+                print('Purging #{}: {} deleted in bulk, {} deleted one by one, {} waiting'
+                      .format(channel.name, counts['bulk'], counts['single'], old_messages.qsize()))
+
+            for _ in workers:
+                old_messages.put_nowait(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        deleted = counts['bulk'] + counts['single']
+        print('Purged {} messages from #{} in {:.2f}s ({} in bulk, {} one by one)'
+              .format(deleted, channel.name, time.monotonic() - start, counts['bulk'], counts['single']))
+        return deleted
+
+    async def __delete_worker(self, messages: asyncio.Queue, counts: dict) -> None:
+        """
+        Deletes messages from the queue `messages` one at a time until it reads None
+        """
 
-        while more_messages:
+        while True:
+            message = await messages.get()
+            if message is None:
+                return
+            try:
+                await self.delete_message(message)
+                counts['single'] += 1
+            except discord.NotFound:
+                pass
 
-            more_messages = False
+    def schedule_board_update(self, server_id: str, board: str) -> None:
+        """
+        Requests an update of a board of the server with the id `server_id`
+        Requests made while an update is already pending are merged into it
 
-            # Retrieve a generator (currently, of up to 100) messages and retrieve messages from it
-            # in the case that the generator is empty(i.e. no more messages)
-            # the next iteration of the while loop will not run
-            async for message in self.logs_from(channel):
-                await self.delete_message(message)
-                more_messages = True
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server to update
+        board: str
+            Either 'score' or 'challenge'
+        """
 
-    async def update_challenge_board(self, server_id: str) -> None:
+        key = (board, server_id)
+        if key not in self._pending_board_updates:
+            self._pending_board_updates[key] = self.loop.create_task(self.__delayed_board_update(key))
+
+    async def __delayed_board_update(self, key) -> None:
+        await asyncio.sleep(self.board_update_delay)
+
+        # Requests made from here on need a new update
+        del self._pending_board_updates[key]
+
+        board, server_id = key
+        await getattr(self, 'update_{}_board'.format(board))(server_id)
+
+    def queue_message(self, destination, content: str = None, embed: discord.Embed = None,
+                      priority: int = PRIORITY_FEED) -> asyncio.Future:
+        """
+        Queues a message to be sent to `destination` by `self.outbound`
+        Returns a future of the sent message, which callers do not have to wait for
+
+        Parameters:
+        ----------
+        destination: `discord.Channel`
+            Where to send the message
+        content: str
+            The content of the message
+        embed: `discord.Embed`
+            The embed of the message
+        priority: int
+            One of the `scheduler.PRIORITY_*` classes
+        """
+
+        return self.outbound.submit(destination, lambda: self.send_message(destination, content, embed=embed),
+                                    priority)
+
+    async def edit_or_send(self, channel: discord.Channel, message: discord.Message,
+                           embed: discord.Embed, key=None) -> discord.Message:
         """
-        Removes the previous list of challenges in every server the bot is in and creates a new one
+        Edits `message` to show `embed`. If there is no such message, `embed` is posted to `channel` instead
+        The request is queued as a board update, a newer request with the same `key` replaces it while it waits
+
+        Returns the message that shows the embed
         """
 
-        for channel in self.get_server(server_id).channels:
-            if channel.name.lower() == 'challenges':
-                # Clean old feed
+        async def edit_or_send():
+            if message is not None:
                 try:
-                    await self.safe_delete_messages(channel)
-                except discord.HTTPException as e:
-                    print(e)
-                else:
+                    return await self.edit_message(message, embed=embed)
+                except discord.NotFound:
+                    pass
+            return await self.send_message(channel, embed=embed)
+
+        return await self.outbound.submit(channel, edit_or_send, PRIORITY_BOARD, key)
+
+    async def update_challenge_board(self, server_id: str) -> None:
+        """
+        Updates the challenge board of the server with the id `server_id`
+        The first update clears the channel and posts every challenge, later updates only post, edit or delete
+        the messages whose challenges were added, changed or removed, see `ChallengeBoard`
+        """
+
+        lock = self._board_locks.setdefault(('challenge', server_id), asyncio.Lock())
+        async with lock:
+            with self.stats.timer(server_id, 'update_challenge_board'):
+                channel = self.routes.get(self.get_server(server_id), 'challenges')
+                if channel is None:
+                    return
+
+                messages = self.board_messages.setdefault(server_id, {})
+
+                if 'header' not in messages:
+                    # Clean old feed
+                    try:
+                        await self.safe_delete_messages(channel)
+                    except discord.HTTPException as e:
+                        print(e)
+                        return
+
                     flag_submission = discord.Embed(title='How to Submit a Flag',
                                                     description='Send me a private message in this format:\n'
                                                                 '<challenge name>:<flag>#{}'.format(server_id),
                                                     color=0x3296d5)
-                    await self.send_message(channel, embed=flag_submission)
-
-                    for challenge_name, challenge in self.events[server_id].challenges.items():
-                        challenge_embed = discord.Embed(title=challenge.name, description=challenge.description,
-                                                        color=0x3296d5)
-                        challenge_embed.add_field(name='Difficulty',
-                                                  value=':triangular_flag_on_post:' * challenge.difficulty, inline=True)
-                        challenge_embed.add_field(name='Reward',
-                                                  value='{} points'.format(challenge.reward), inline=True)
-                        challenge_embed.add_field(name='Category',
-                                                  value=challenge.category, inline=True)
-                        await self.send_message(channel, embed=challenge_embed)
+                    messages['header'] = await self.queue_message(channel, embed=flag_submission,
+                                                                  priority=PRIORITY_BOARD)
+                    messages['challenges'] = ChallengeBoard(self.challenge_group_size, self.short_description_length)
+
+                board = messages['challenges']
+                removed, changed = board.diff(self.events[server_id].challenges.values())
+
+                for message in removed:
+                    self.outbound.submit(channel, lambda message=message: self.delete_message(message),
+                                         PRIORITY_BOARD)
+
+                for key, digests, embed, message in changed:
+                    message = await self.edit_or_send(channel, message, embed, ('challenge', server_id) + key)
+                    board.set_posted(key, digests, message)
 
     async def update_score_board(self, server_id: str) -> None:
         """
         Updates the scoreboard of the server with the id `server_id`
+        The first update clears the channel and posts the scoreboard pages, later updates only edit the pages whose
+        text changed, and post or delete pages as the scoreboard grows or shrinks
         """
 
-        for channel in self.get_server(server_id).channels:
-            if channel.name.lower() == 'scoreboard':
-                # Clean old feed
-                try:
-                    await self.safe_delete_messages(channel)
-                except discord.HTTPException as e:
-                    print(e)
-                else:
-                    scoreboard_embed = discord.Embed(title="Scoreboard",
-                                                     description=self.events[server_id].scoreboard.get_board(),
-                                                     color=0x38bc35)
-                    await self.send_message(channel, embed=scoreboard_embed)
+        lock = self._board_locks.setdefault(('score', server_id), asyncio.Lock())
+        async with lock:
+            with self.stats.timer(server_id, 'update_score_board'):
+                channel = self.routes.get(self.get_server(server_id), 'scoreboard')
+                if channel is None:
+                    return
+
+                messages = self.board_messages.setdefault(server_id, {})
+
+                if 'scoreboard' not in messages:
+                    # Clean old feed
+                    try:
+                        await self.safe_delete_messages(channel)
+                    except discord.HTTPException as e:
+                        print(e)
+                        return
+                    messages['scoreboard'] = []
+
+                pages = self.events[server_id].scoreboard.get_pages(self.scoreboard_rows_per_page,
+                                                                    self.embed_description_limit,
+                                                                    self.scoreboard_hide_zero,
+                                                                    self.scoreboard_max_pages,
+                                                                    self.display_names.name_of(channel.server))
+                if not pages:
+                    pages = ['No points were scored yet']
+
+                posted = messages['scoreboard']
+                for message in [message for _, message in posted[len(pages):]]:
+                    self.outbound.submit(channel, lambda message=message: self.delete_message(message),
+                                         PRIORITY_BOARD)
+                del posted[len(pages):]
+
+                for index, page in enumerate(pages):
+                    old_page, message = posted[index] if index < len(posted) else (None, None)
+                    if page == old_page:
+                        continue
+
+                    title = 'Scoreboard' if index == 0 else 'Scoreboard (page {})'.format(index + 1)
+                    scoreboard_embed = discord.Embed(title=title, description=page, color=0x38bc35)
+                    message = await self.edit_or_send(channel, message, scoreboard_embed,
+                                                      ('score', server_id, index))
+                    if index < len(posted):
+                        posted[index] = (page, message)
+                    else:
+                        posted.append((page, message))
 
     async def update_answer_feed(self, server_id: str, challenge: Challenge, member: discord.User) -> None:
         """
@@ -187,14 +994,8 @@ class Bot(discord.Client):
             The challenge that was completed
         """
 
-        server = None
-        for s in self.servers:
-            if s.id == server_id:
-                server = s
-
-        for channel in server.channels:
-            if channel.name.lower() == 'feed':
-                await self.send_message(channel,
-                                        '{} Just solved **{}**! :crown:'
-                                        .format(member.name, challenge.name))
-                break
+        with self.stats.timer(server_id, 'update_answer_feed'):
+            channel = self.routes.get(self.get_server(server_id), 'feed')
+            if channel is not None:
+                self.queue_message(channel, '{} Just solved **{}**! :crown:'.format(member.name, challenge.name),
+                                   priority=PRIORITY_FEED)
@@ -1,3 +1,39 @@
+import bisect
+import hashlib
+import hmac
+import math
+import time
+
+
+def normalize_name(name: str) -> str:
+    """
+    Returns the form of a challenge name used for lookups. Challenge names are case and space insensitive
+    """
+
+    return name.replace(' ', '').lower()
+
+
+def hash_flag(flag: str) -> bytes:
+    """
+    Returns the digest used to look up a challenge by its flag
+    """
+
+    return hashlib.sha256(flag.encode()).digest()
+
+
+def dynamic_reward(initial: int, minimum: int, decay: int, solves: int) -> int:
+    """
+    Returns the reward of a challenge worth `initial` points once it has `solves` solves
+    Dynamic challenges lose value on a parabola, like in CTFd. The first solve is worth `initial` points and
+    the value reaches `minimum` after `decay` more solves. Challenges without a `minimum` or `decay` are static
+    """
+
+    if minimum is None or not decay:
+        return initial
+
+    value = math.ceil((minimum - initial) / decay ** 2 * max(solves - 1, 0) ** 2 + initial)
+    return max(value, minimum)
+
 
 class Challenge(object):
     """
@@ -16,76 +52,410 @@ class Challenge(object):
     difficulty: int
         The difficulty of the challenge(number of :triangular_flag_on_post: displayed)
     reward: int
-        Number of points awarded for completing the challenge
+        Number of points awarded for completing the challenge.
+        For a dynamic challenge this is its current value, which every solver of the challenge is awarded
+    initial: int
+        The reward given in the challenge file
+    minimum: int
+        Lowest reward of a dynamic challenge, None if the challenge is static
+    decay: int
+        Number of solves after the first one it takes a dynamic challenge to reach `minimum`, see `dynamic_reward`
+    id: int
+        Small integer id of the challenge in its `Event`, used as its bit in `Event.solves`.
+        None until the challenge is added to an event
     """
 
-    def __init__(self, flag: str, name: str, category: str, description='', difficulty=0, reward=0):
+    __slots__ = ('flag', 'description', 'difficulty', 'name', 'reward', 'category', 'id', 'initial', 'minimum',
+                 'decay')
+
+    def __init__(self, flag: str, name: str, category: str, description='', difficulty=0, reward=0, minimum=None,
+                 decay=0):
         self.flag = flag
         self.description = description
         self.difficulty = difficulty
         self.name = name
         self.reward = reward
+        self.initial = reward
+        self.minimum = minimum
+        self.decay = decay
         self.category = category
+        self.id = None
 
     def __str__(self) -> str:
         return self.name
 
+    @property
+    def dynamic(self) -> bool:
+        return self.minimum is not None and bool(self.decay)
+
+    def value(self, solves: int) -> int:
+        """
+        Returns the reward of the challenge once it has `solves` solves
+        """
+
+        return dynamic_reward(self.initial, self.minimum, self.decay, solves)
+
+
+def parse_challenges(p: str, strict: bool = False):
+    """
+    Returns the challenges of the challenge file `p`, keyed by name
+    Invalid lines are skipped, unless `strict` is True, in which case a ValueError is raised instead
+    File format:
+    <Flag>|<Name>|<Category>|<Description>|<Difficulty>|<Reward>\n
+    or, for a challenge whose reward decays with every solve, see `dynamic_reward`:
+    <Flag>|<Name>|<Category>|<Description>|<Difficulty>|<Reward>|<Minimum>|<Decay>\n
+    """
+
+    challenges = {}
+
+    with open(p, 'r') as file:
+        data = file.read()
+
+    for line_number, challenge in enumerate(data.strip('\n').split('\n'), 1):
+        tmp = challenge.split('|')
+        try:
+            if len(tmp) > 6:
+                challenges[tmp[1]] = Challenge(tmp[0], tmp[1], tmp[2], tmp[3], int(tmp[4]), int(tmp[5]), int(tmp[6]),
+                                               int(tmp[7]))
+            else:
+                challenges[tmp[1]] = Challenge(tmp[0], tmp[1], tmp[2], tmp[3], int(tmp[4]), int(tmp[5]))
+        except (IndexError, ValueError) as e:
+            if strict:
+                raise ValueError('Invalid format on line {} of {}: {}'.format(line_number, p, e))
+            print('Invalid format: {}'.format(e))
+
+    return challenges
+
+
+def challenge_fields(challenge: Challenge) -> tuple:
+    """
+    Returns a tuple of every field of `challenge` that is defined in the challenge file
+    """
+
+    return challenge.flag, challenge.name, challenge.category, challenge.description, challenge.difficulty, \
+        challenge.initial, challenge.minimum, challenge.decay
+
+
+def challenge_scoring(challenge: Challenge) -> tuple:
+    """
+    Returns a tuple of the fields of `challenge` its reward is computed from, see `dynamic_reward`
+    """
+
+    return challenge.initial, challenge.minimum, challenge.decay
+
+
+def challenge_digest(challenge: Challenge) -> bytes:
+    """
+    Returns a hash of the fields of `challenge` shown in the challenge board, see `board.ChallengeBoard`
+    """
+
+    data = '\x1f'.join((challenge.name, challenge.description, challenge.category, str(challenge.difficulty),
+                        str(challenge.reward)))
+    return hashlib.sha256(data.encode()).digest()
+
 
 class Scoreboard(object):
     """
     Class representing the servers' scoreboard
+    The members are kept ordered by score, so updating a score and looking up a rank only needs a binary search
+    Members are keyed by their id and only take part once they score, so idle members cost nothing
 
     Attributes:
     ----------
     participants: dict
-        Dictionary of the servers' members.
-        The key is of type `discord.Member`.
+        Dictionary of the participating members.
+        The key is the member id.
         The value is the members' score.
+        The dictionary is built on access, use `get_score` to look up a single member
     """
 
+    __slots__ = ('_order', '_keys', '_seq')
+
     def __init__(self, participants=None):
+        # Sorted list of (-score, reached_at, seq, member id) keys.
+        # Higher scores come first, ties are broken by who reached the score first.
+        # `seq` is unique, so member ids are never compared
+        self._order = []
+        self._keys = {}
+        self._seq = 0
+
         if participants:
-            self.participants = participants
-        else:
-            self.participants = {}
+            for member_id, score in participants.items():
+                self.set_score(member_id, score)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __contains__(self, member_id: str) -> bool:
+        return member_id in self._keys
 
-    def add_participant(self, member) -> None:
+    @property
+    def participants(self) -> dict:
+        return {member_id: -key[0] for member_id, key in self._keys.items()}
+
+    def get_score(self, member_id: str) -> int:
+        """
+        Returns the score of the member with the id `member_id`, or None if they are not participating
         """
-        Adds `member` to the internal list of challenge participants if they are not already in the list
+
+        key = self._keys.get(member_id)
+        return None if key is None else -key[0]
+
+    def add_participant(self, member_id: str) -> None:
+        """
+        Adds the member with the id `member_id` to the internal list of challenge participants
+        if they are not already in the list
 
         Parameters:
         ----------
-        member: `discord.Member`
-            Member to add to the internal list
+        member_id: str
+            ID of the member to add to the internal list
         """
 
-        if member not in self.participants:
-            self.participants[member] = 0
+        if member_id not in self._keys:
+            self._seq += 1
+            key = (0, 0, self._seq, member_id)
+            self._keys[member_id] = key
+            bisect.insort(self._order, key)
 
-    def add_score(self, member, score: int) -> None:
+    def add_participants(self, entries) -> None:
         """
-        Adds `score` points to the members' current score
+        Adds every member of `entries` that is not already participating, sorting the scoreboard once
+        Faster than adding the members one by one when many members are added at once
+
+        Parameters:
+        ----------
+        entries: Iterable[tuple]
+            (member id, score, time the score was reached) tuples. The time can be None if the score is 0
+        """
+
+        for member_id, score, reached_at in entries:
+            if member_id not in self._keys:
+                self._seq += 1
+                key = (-score, reached_at or 0, self._seq, member_id)
+                self._keys[member_id] = key
+                self._order.append(key)
+        self._order.sort()
+
+    def add_score(self, member_id: str, score: int, solved_at: float = None) -> None:
+        """
+        Adds `score` points to the members' current score, registering the member if this is their first score
 
         Parameters:
         ---------
-        member: `discord.Member`
-            Member to add points to
+        member_id: str
+            ID of the member to add points to
         score: int
             How many points should be added to the score
+        solved_at: float
+            Timestamp of the solve, used to break ties. Defaults to now
+        """
+
+        if solved_at is None:
+            solved_at = time.time()
+
+        key = self._keys.get(member_id)
+        self.set_score(member_id, score if key is None else -key[0] + score, solved_at)
+
+    def set_score(self, member_id: str, score: int, solved_at: float = None) -> None:
+        """
+        Sets the members' score to `score`
+
+        Parameters:
+        ---------
+        member_id: str
+            ID of the member whose score is set
+        score: int
+            The new score of the member
+        solved_at: float
+            Timestamp of the solve, used to break ties. Defaults to the time the member reached their previous score
+        """
+
+        old_key = self._keys.get(member_id)
+        if old_key is None:
+            self._seq += 1
+            old_key = (0, 0, self._seq, member_id)
+        else:
+            del self._order[bisect.bisect_left(self._order, old_key)]
+
+        if solved_at is None:
+            solved_at = old_key[1]
+        key = (-score, solved_at, old_key[2], member_id)
+
+        self._keys[member_id] = key
+        bisect.insort(self._order, key)
+
+    def remove(self, member_id: str) -> None:
+        """
+        Removes the member with the id `member_id` from the scoreboard, if they are participating
+        """
+
+        key = self._keys.pop(member_id, None)
+        if key is not None:
+            del self._order[bisect.bisect_left(self._order, key)]
+
+    def reached_at(self, member_id: str) -> float:
+        """
+        Returns the time the member with the id `member_id` reached their current score,
+        or None if they are not participating
+        """
+
+        key = self._keys.get(member_id)
+        return None if key is None else key[1]
+
+    def get_rank(self, member_id: str) -> int:
+        """
+        Returns the 1-based position of the member with the id `member_id` in the scoreboard,
+        or None if they are not participating
         """
 
-        self.participants[member] += score
+        if member_id not in self._keys:
+            return None
+        return bisect.bisect_left(self._order, self._keys[member_id]) + 1
 
-    def get_board(self) -> str:
+    def top(self, count: int = None, start: int = 0):
+        """
+        Returns a list of (member id, score) tuples of the `count` members starting at the position `start`
+        If `count` is None, every member from `start` onward is returned
+        """
+
+        stop = None if count is None else start + count
+        return [(key[3], -key[0]) for key in self._order[start:stop]]
+
+    def get_board(self, count: int = None, name_of=str) -> str:
         """
         Returns a string representation of the scoreboard sorted from the highest score to the lowest
+        If `count` is given, only the first `count` rows are rendered
+        Names are looked up with `name_of`, see `get_pages`
+        """
+
+        lines = []
+        for member_id, score in self.top(count):
+            name = name_of(member_id)
+            if name is not None:
+                lines.append('{}:  {}\n'.format(name, score))
+        return ''.join(lines)
+
+    def get_pages(self, rows_per_page: int = 25, max_length: int = 2048, hide_zero: bool = False,
+                  max_pages: int = None, name_of=str) -> list:
+        """
+        Returns the scoreboard rendered as a list of pages, from the highest score to the lowest
+        Rows are streamed from the ordered scoreboard, so rendering stops as soon as the last page is full,
+        and only the names of rendered rows are looked up
+
+        Parameters:
+        ----------
+        rows_per_page: int
+            Maximum number of rows in a page
+        max_length: int
+            Maximum number of characters in a page, e.g. the limit of an embed description
+        hide_zero: bool
+            Whether members without points are left out
+        max_pages: int
+            Maximum number of pages rendered, every page if None
+        name_of: Callable[[str], str]
+            Returns the name shown for a member id, or None to leave the member out
+        """
+
+        pages = []
+        lines = []
+        length = 0
+        for key in self._order:
+            score = -key[0]
+            # Members without points are ordered last
+            if hide_zero and score <= 0:
+                break
+
+            name = name_of(key[3])
+            if name is None:
+                continue
+
+            line = '{}:  {}\n'.format(name, score)[:max_length]
+            if lines and (len(lines) >= rows_per_page or length + len(line) > max_length):
+                pages.append(''.join(lines))
+                if len(pages) == max_pages:
+                    return pages
+                lines = []
+                length = 0
+            lines.append(line)
+            length += len(line)
+
+        if lines:
+            pages.append(''.join(lines))
+        return pages
+
+
+class SolveHistory(object):
+    """
+    Class holding the solves of a server in the order they were made, read incrementally from the submission log,
+    so the scoreboard at any past time is computed without scanning the log again
+
+    Attributes:
+    ----------
+    last_id: int
+        ID of the newest submission read, see `Database.load_solve_log`
+    solves: list
+        (timestamp, member id, challenge name) tuples of the first correct submission of every member to every
+        challenge, sorted by timestamp
+    """
+
+    def __init__(self):
+        self.last_id = 0
+        self.solves = []
+        # Key is a (member id, challenge name) tuple, value is the timestamp of the solve
+        self._solved_at = {}
+
+    def extend(self, submissions) -> None:
+        """
+        Adds the correct submissions `submissions` to the history
+
+        Parameters:
+        ----------
+        submissions: Iterable[tuple]
+            (submission id, member id, challenge name, timestamp) tuples, as returned by `Database.load_solve_log`
         """
 
-        scoreboard = ''
-        for member in sorted(self.participants, key=self.participants.get, reverse=True):
-            if not member.bot:
-                scoreboard += '{}:  {}\n'.format(member.display_name, self.participants[member])
-        return scoreboard
+        for submission_id, member_id, challenge_name, submitted_at in submissions:
+            self.last_id = max(self.last_id, submission_id)
+
+            key = (member_id, challenge_name)
+            solved_at = self._solved_at.get(key)
+            if solved_at is not None:
+                if solved_at <= submitted_at:
+                    continue
+                # Submissions are logged in about the order they were made, so an earlier one is rare
+                self.solves.remove((solved_at, member_id, challenge_name))
+
+            self._solved_at[key] = submitted_at
+            bisect.insort(self.solves, (submitted_at, member_id, challenge_name))
+
+    def scores_at(self, until: float, challenges: dict) -> list:
+        """
+        Returns a list of (member id, score, last solve timestamp) tuples of every member who scored up to the time
+        `until`. Dynamic challenges are worth what they were worth at that time
+
+        Parameters:
+        ----------
+        until: float
+            Timestamp the scores are computed at
+        challenges: dict
+            The current challenges keyed by name, solves of other challenges are not scored
+        """
+
+        solves = self.solves[:bisect.bisect_right(self.solves, (until, chr(0x10ffff)))]
+
+        solve_counts = {}
+        for _, _, challenge_name in solves:
+            solve_counts[challenge_name] = solve_counts.get(challenge_name, 0) + 1
+        rewards = {name: challenge.value(solve_counts.get(name, 0)) for name, challenge in challenges.items()}
+
+        scores = {}
+        for solved_at, member_id, challenge_name in solves:
+            reward = rewards.get(challenge_name)
+            if reward is not None:
+                score, _ = scores.get(member_id, (0, None))
+                scores[member_id] = (score + reward, solved_at)
+        return [(member_id, score, solved_at) for member_id, (score, solved_at) in scores.items()]
 
 
 class Event(object):
@@ -104,44 +474,269 @@ class Event(object):
     solves: dict
         Dictionary of challenges solved by a server member
         Key is member id
-        Value is list of solved challenges.
+        Value is a bitset of the ids of the solved challenges, see `Challenge.id`
+    solvers: dict
+        Members who solved each challenge, so a change of reward only touches them
+        Key is challenge id
+        Value is the set of ids of the members who solved the challenge
+    solve_times: dict
+        Solve curve of every challenge, kept up to date with every solve
+        Key is challenge id
+        Value is the sorted list of the times the challenge was solved. Solves of unknown time count as 0
+    challenge_list: list[Challenge]
+        Challenges indexed by their id. Ids of removed challenges are None
     server_id: str
         The server id
+    name_index: dict[str, Challenge]
+        Challenges keyed by their normalized name, see `normalize_name`
+    flag_index: dict[bytes, Challenge]
+        Challenges keyed by the hash of their flag, see `hash_flag`.
+        Flags shared by more than one challenge are left out since they can not identify a challenge
     """
 
     def __init__(self, server_id: str):
 
         self.challenges = {}
+        self.challenge_list = []
+        self.name_index = {}
+        self.flag_index = {}
         self.scoreboard = Scoreboard()
         self.solves = {}
+        self.solvers = {}
+        self.solve_times = {}
         self.server_id = server_id
 
-    def add_points(self, member, challenge: Challenge) -> bool:
+    def add_points(self, member_id: str, challenge: Challenge, solved_at: float = None) -> bool:
         """
-        Checks if the user `member` had already completed the challenge and tries to add to his score
+        Checks if the user with the id `member_id` had already completed the challenge and tries to add to their score
         If the challenge has already been solved returns False
         If the challenge is yet to be solved returns True and adds the appropriate number of points to the users' score
+        If the solve lowers the reward of a dynamic challenge, the difference is taken from its other solvers only
 
         Parameters:
         ----------
-        member: `discord.Member`
-            Member to check
+        member_id: str
+            ID of the member to check
         challenge: `Challenge`
             Challenge to check
+        solved_at: float
+            Timestamp of the solve. Defaults to now
 
         """
 
-        if member.id in self.solves and challenge.name in self.solves[member.id]:
+        solved = self.solves.get(member_id, 0)
+        bit = 1 << challenge.id
+        if solved & bit:
             return False
-        self.scoreboard.add_score(member, challenge.reward)
+        if solved_at is None:
+            solved_at = time.time()
 
         # Add challenge to solved challenges
-        if member.id not in self.solves:
-            self.solves[member.id] = [challenge.name]
-        else:
-            self.solves[member.id].append(challenge.name)
+        self.solves[member_id] = solved | bit
+        solvers = self.solvers.setdefault(challenge.id, set())
+        solvers.add(member_id)
+        self.record_solve_time(challenge, solved_at)
+
+        if challenge.dynamic:
+            self.change_reward(challenge, challenge.value(len(solvers)), member_id)
+        self.scoreboard.add_score(member_id, challenge.reward, solved_at)
         return True
 
+    def remove_solve(self, member_id: str, challenge: Challenge, solved_at: float = None) -> bool:
+        """
+        Undoes the `add_points` of the member with the id `member_id` for `challenge`, e.g. when it could not be saved
+        Returns False if the member did not solve the challenge
+        If the challenge is dynamic, its other solvers get back the points the solve took from them
+
+        Parameters:
+        ----------
+        member_id: str
+            ID of the member
+        challenge: `Challenge`
+            The solved challenge
+        solved_at: float
+            Timestamp the solve was added with
+        """
+
+        if not self.has_solved(member_id, challenge):
+            return False
+
+        self.solves[member_id] &= ~(1 << challenge.id)
+        solvers = self.solvers[challenge.id]
+        solvers.discard(member_id)
+
+        times = self.solve_times.get(challenge.id, [])
+        index = bisect.bisect_left(times, solved_at or 0.0)
+        if index < len(times) and times[index] == (solved_at or 0.0):
+            del times[index]
+
+        score = self.scoreboard.get_score(member_id)
+        if score is not None:
+            self.scoreboard.set_score(member_id, score - challenge.reward)
+        if challenge.dynamic:
+            self.change_reward(challenge, challenge.value(len(solvers)))
+        return True
+
+    def change_reward(self, challenge: Challenge, reward: int, exclude: str = None) -> set:
+        """
+        Sets the reward of `challenge` to `reward` and moves the score of every member who solved it by the difference
+        Returns the set of ids of the members whose score changed
+
+        Parameters:
+        ----------
+        challenge: `Challenge`
+            The challenge whose reward changed
+        reward: int
+            The new reward
+        exclude: str
+            ID of a member whose score is left as it is
+        """
+
+        delta = reward - challenge.reward
+        challenge.reward = reward
+        if not delta:
+            return set()
+
+        changed = set()
+        for member_id in self.solvers.get(challenge.id, ()):
+            score = self.scoreboard.get_score(member_id)
+            if member_id != exclude and score is not None:
+                # The time the member reached their score is kept, since they did not solve anything
+                self.scoreboard.set_score(member_id, score + delta)
+                changed.add(member_id)
+        return changed
+
+    def update_rewards(self) -> None:
+        """
+        Sets the reward of every dynamic challenge from its number of solves, without touching any score
+        Used once the solves of the event are loaded
+        """
+
+        for challenge in self.challenges.values():
+            if challenge.dynamic:
+                challenge.reward = challenge.value(len(self.solvers.get(challenge.id, ())))
+
+    def compute_score(self, member_id: str) -> int:
+        """
+        Returns the score of the member with the id `member_id` from the current rewards of the challenges they solved
+        """
+
+        return sum(challenge.reward for challenge in self.solved_challenges(member_id))
+
+    def forget_member(self, member_id: str) -> None:
+        """
+        Forgets the solves and the score of the member with the id `member_id`, e.g. when they left the server
+        Rewards of dynamic challenges are not updated, see `update_rewards`
+        """
+
+        for challenge in self.solved_challenges(member_id):
+            self.solvers[challenge.id].discard(member_id)
+        self.solves.pop(member_id, None)
+        self.scoreboard.remove(member_id)
+
+    def record_solve_time(self, challenge: Challenge, solved_at: float) -> None:
+        """
+        Adds a solve at `solved_at` to the solve curve of `challenge`
+        """
+
+        times = self.solve_times.setdefault(challenge.id, [])
+        solved_at = solved_at or 0.0
+        # Solves nearly always arrive in order, so this is an append
+        if not times or times[-1] <= solved_at:
+            times.append(solved_at)
+        else:
+            bisect.insort(times, solved_at)
+
+    def solve_curve(self, challenge: Challenge) -> list:
+        """
+        Returns a list of (time, number of solves) tuples of `challenge`, one per solve in the order they happened
+        """
+
+        return [(solved_at, count) for count, solved_at in enumerate(self.solve_times.get(challenge.id, ()), 1)]
+
+    def solve_count(self, challenge: Challenge, until: float = None) -> int:
+        """
+        Returns the number of solves of `challenge`, or of those up to the time `until` if given
+        """
+
+        times = self.solve_times.get(challenge.id, ())
+        if until is None:
+            return len(times)
+        return bisect.bisect_right(times, until)
+
+    def rewards(self) -> dict:
+        """
+        Returns a dictionary of the reward of every challenge, keyed by challenge name
+        """
+
+        return {name: challenge.reward for name, challenge in self.challenges.items()}
+
+    def scoring(self) -> dict:
+        """
+        Returns a dictionary of the `challenge_scoring` of every challenge, keyed by challenge name
+        """
+
+        return {name: challenge_scoring(challenge) for name, challenge in self.challenges.items()}
+
+    def has_solved(self, member_id: str, challenge: Challenge) -> bool:
+        """
+        Returns True if the member with the id `member_id` solved `challenge`
+        """
+
+        return bool(self.solves.get(member_id, 0) >> challenge.id & 1)
+
+    def mark_solved(self, member_id: str, challenge_name: str, solved_at: float = None) -> Challenge:
+        """
+        Records that the member with the id `member_id` solved the challenge `challenge_name`, without scoring it
+        Returns the challenge if it was not solved by the member before, otherwise None
+        Challenges that are not defined in the event are ignored
+
+        Parameters:
+        ----------
+        member_id: str
+            ID of the member
+        challenge_name: str
+            Name of the solved challenge
+        solved_at: float
+            Timestamp of the solve, None if it is not known
+        """
+
+        challenge = self.challenges.get(challenge_name)
+        if challenge is not None:
+            solved = self.solves.get(member_id, 0)
+            bit = 1 << challenge.id
+            if not solved & bit:
+                self.solves[member_id] = solved | bit
+                self.solvers.setdefault(challenge.id, set()).add(member_id)
+                self.record_solve_time(challenge, solved_at)
+                return challenge
+        return None
+
+    def replay_solve(self, member_id: str, challenge_name: str, solved_at: float = None) -> Challenge:
+        """
+        Scores a stored solve of the challenge `challenge_name` like `add_points`
+        Returns the challenge if it was not solved by the member before, otherwise None
+        Used to rebuild the event from stored solves or submissions
+        """
+
+        challenge = self.challenges.get(challenge_name)
+        if challenge is not None and self.add_points(member_id, challenge, solved_at or 0):
+            return challenge
+        return None
+
+    def solved_challenges(self, member_id: str):
+        """
+        Returns a list of the challenges solved by the member with the id `member_id`
+        """
+
+        solved = []
+        mask = self.solves.get(member_id, 0)
+        while mask:
+            lowest = mask & -mask
+            solved.append(self.challenge_list[lowest.bit_length() - 1])
+            mask ^= lowest
+        return solved
+
     def load_challenges(self, p: str) -> None:
         """
         Load challenges from file
@@ -150,36 +745,165 @@ class Event(object):
         :param p: path to file
         """
 
-        with open(p, 'r') as file:
-            # Clean old challenges
-            self.challenges = {}
+        # Clean old challenges
+        self.challenges = parse_challenges(p)
 
-            data = file.read()
+        self.build_indexes()
 
-            challenges = data.strip('\n').split('\n')
+    def diff_challenges(self, challenges):
+        """
+        Compares `challenges` to the challenges of the event
+        Returns a tuple of the lists of names of added, removed and changed challenges
 
-            for challenge in challenges:
-                tmp = challenge.split('|')
-                try:
-                    self.challenges[tmp[1]] = Challenge(tmp[0], tmp[1], tmp[2], tmp[3], int(tmp[4]), int(tmp[5]))
-                except IndexError as e:
-                    print('Invalid format: {}'.format(e))
+        Parameters:
+        ----------
+        challenges: dict[str, Challenge]
+            The new challenges, keyed by name
+        """
+
+        added = [name for name in challenges if name not in self.challenges]
+        removed = [name for name in self.challenges if name not in challenges]
+        changed = [name for name, challenge in challenges.items()
+                   if name in self.challenges
+                   and challenge_fields(challenge) != challenge_fields(self.challenges[name])]
+        return added, removed, changed
+
+    def apply_challenges(self, challenges):
+        """
+        Replaces the challenges of the event with `challenges`, touching only the challenges that differ
+        Changed challenges are updated in place and keep their id, removed challenges are taken out of every solve
+        Returns a tuple of the `diff_challenges` lists and the set of ids of members whose score has to be recomputed
+
+        Parameters:
+        ----------
+        challenges: dict[str, Challenge]
+            The new challenges, keyed by name
+        """
+
+        added, removed, changed = self.diff_challenges(challenges)
+
+        # Only the solvers of removed challenges and of challenges whose reward changed are rescored
+        affected = set()
+        removed_bits = 0
+        for name in removed:
+            challenge = self.challenges.pop(name)
+            self.challenge_list[challenge.id] = None
+            self.solve_times.pop(challenge.id, None)
+            removed_bits |= 1 << challenge.id
+            affected |= self.solvers.pop(challenge.id, set())
+
+        for name in changed:
+            challenge = self.challenges[name]
+            for field in ('flag', 'category', 'description', 'difficulty', 'initial', 'minimum', 'decay'):
+                setattr(challenge, field, getattr(challenges[name], field))
+            reward = challenge.value(len(self.solvers.get(challenge.id, ())))
+            if reward != challenge.reward:
+                challenge.reward = reward
+                affected |= self.solvers.get(challenge.id, set())
+
+        for name in added:
+            self.challenges[name] = challenges[name]
+
+        # Forget solves of removed challenges, their ids are never given again
+        if removed_bits:
+            for member_id in affected:
+                if member_id in self.solves:
+                    self.solves[member_id] &= ~removed_bits
+
+        self.build_indexes()
+        return (added, removed, changed), affected
+
+    def build_indexes(self) -> None:
+        """
+        Builds the lookup tables used by `check_answer` from `self.challenges` and gives new challenges an id
+        """
+
+        self.name_index = {}
+        self.flag_index = {}
+        shared_flags = set()
+
+        for challenge in self.challenges.values():
+            # Challenges keep their id, so existing solves stay valid
+            if challenge.id is None:
+                challenge.id = len(self.challenge_list)
+                self.challenge_list.append(challenge)
+
+            self.name_index[normalize_name(challenge.name)] = challenge
 
-    def check_answer(self, flag: str, challenge_name: str) -> Challenge:
+            flag_hash = hash_flag(challenge.flag)
+            if flag_hash in self.flag_index:
+                shared_flags.add(flag_hash)
+            self.flag_index[flag_hash] = challenge
+
+        for flag_hash in shared_flags:
+            del self.flag_index[flag_hash]
+
+    def snapshot(self) -> dict:
+        """
+        Returns the state of the event as plain data, see `restore`
+        The scores are kept as (member id, score, time the score was reached) tuples of the members with points
+        """
+
+        challenges = [None if challenge is None else (challenge.id,) + challenge_fields(challenge)
+                      for challenge in self.challenge_list]
+        scores = [(member_id, score, self.scoreboard.reached_at(member_id))
+                  for member_id, score in self.scoreboard.top() if score]
+        solve_times = {challenge_id: list(times) for challenge_id, times in self.solve_times.items()}
+        return {'challenges': challenges, 'solves': dict(self.solves), 'scores': scores, 'solve_times': solve_times}
+
+    @classmethod
+    def restore(cls, server_id: str, state: dict):
+        """
+        Returns the event saved with `snapshot`. Challenges keep their ids, so the saved solves stay valid
+        The scoreboard is left empty, so only the scores of members who are still in the server are added to it
+
+        Parameters:
+        ----------
+        server_id: str
+            The server id
+        state: dict
+            The state returned by `snapshot`
+        """
+
+        event = cls(server_id)
+        for fields in state['challenges']:
+            if fields is None:
+                event.challenge_list.append(None)
+                continue
+            challenge = Challenge(*fields[1:])
+            challenge.id = fields[0]
+            event.challenge_list.append(challenge)
+            event.challenges[challenge.name] = challenge
+
+        event.build_indexes()
+        event.solves = dict(state['solves'])
+        for member_id in event.solves:
+            for challenge in event.solved_challenges(member_id):
+                event.solvers.setdefault(challenge.id, set()).add(member_id)
+        event.update_rewards()
+        event.solve_times = {challenge_id: list(times) for challenge_id, times in state['solve_times'].items()}
+        return event
+
+    def check_answer(self, flag: str, challenge_name: str = None) -> Challenge:
         """
         Checks if the answer which was given to the challenge.
         If the answer is correct, returns the Challenge object. Otherwise, None is returned
+        The flag is compared in constant time
 
         Parameters:
         ----------
         flag: str
             The flag to the challenge
         challenge_name: str
-            The challenge the answer was given to. Challenge names are case-insensitive
+            The challenge the answer was given to. Challenge names are case-insensitive.
+            If no name is given, the challenge is looked up by the flag alone
         """
 
-        for challenge in self.challenges:
-            if challenge.replace(' ', '').lower() == challenge_name.lower():
-                if flag == self.challenges[challenge].flag:
-                    return self.challenges[challenge]
+        if challenge_name:
+            challenge = self.name_index.get(normalize_name(challenge_name))
+        else:
+            challenge = self.flag_index.get(hash_flag(flag))
+
+        if challenge and hmac.compare_digest(flag.encode(), challenge.flag.encode()):
+            return challenge
         return None
@@ -1,9 +1,17 @@
 from os import path, mkdir
+import hashlib
 import sqlite3
 from typing import List, Dict, Iterable
 
+from challenge import dynamic_reward
+
 solved_table_name = 'solved_challenges'
+scores_table_name = 'scores'
+score_sources_table_name = 'score_sources'
+submissions_table_name = 'submissions'
 database_directory = path.join(path.dirname(path.abspath(__file__)), 'database')
+# SQLite accepts at most 999 parameters in a query
+servers_per_query = 500
 
 
 class Database(object):
@@ -34,9 +42,7 @@ class Database(object):
         Creates the database connection object and cursor object.
         """
 
-        self.connection = sqlite3.connect(path.join(database_directory, self.database_path))
-        self.cursor = self.connection.cursor()
-        return self
+        return self.open()
 
     def __exit__(self, exc_type, exc_val, exc_traceback):
         """
@@ -44,6 +50,34 @@ class Database(object):
         Destroys the DB connection object.
         """
 
+        self.close()
+
+    def open(self, check_same_thread=True):
+        """
+        Creates the database connection object and cursor object.
+        The connection is meant to be long-lived, so it is put in WAL mode which lets readers work
+        alongside the single writer and makes every commit a cheap append to the log
+
+        Parameters:
+        ----------
+        check_same_thread: bool
+            Passed to `sqlite3.connect`. Set it to False to close a connection from another thread than the one using it
+        """
+
+        self.connection = sqlite3.connect(self.database_path, check_same_thread=check_same_thread)
+        self.cursor = self.connection.cursor()
+
+        self.cursor.execute('PRAGMA journal_mode=WAL')
+        self.cursor.execute('PRAGMA synchronous=NORMAL')
+        self.cursor.execute('PRAGMA temp_store=MEMORY')
+        self.cursor.execute('PRAGMA busy_timeout=5000')
+        return self
+
+    def close(self) -> None:
+        """
+        Destroys the DB connection object.
+        """
+
         self.connection.close()
 
     def check_create_tables(self) -> None:
@@ -56,12 +90,61 @@ class Database(object):
 
         if self.cursor.fetchone() is None:
             print("Solved challenges table not found. Creating one now")
+            self.create_solved_table(solved_table_name)
+
+        self.cursor.execute("PRAGMA table_info({})".format(solved_table_name))
+        columns = [column[1] for column in self.cursor.fetchall()]
+        if 'solved_at' not in columns:
+            self.cursor.execute("ALTER TABLE {} ADD COLUMN solved_at REAL".format(solved_table_name))
+        if 'id' not in columns:
+            # Row ids of deleted solves are given again, so replaying the solves saved after a snapshot needs an id
+            # that only grows. Existing solves keep their row id as their id
+            self.create_solved_table(solved_table_name + '_new')
+            self.cursor.execute("""INSERT INTO {0}_new (id, user, server_id, challenge_name, solved_at)
+                SELECT rowid, user, server_id, challenge_name, solved_at FROM {0} ORDER BY rowid"""
+                                .format(solved_table_name))
+            self.cursor.execute("DROP TABLE {}".format(solved_table_name))
+            self.cursor.execute("ALTER TABLE {0}_new RENAME TO {0}".format(solved_table_name))
+
+        # Materialized score of every member, kept up to date by `insert_solve`
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS {}(
+        server_id varchar(40),
+        user varchar(40),
+        score INTEGER,
+        last_solve_at REAL,
+        PRIMARY KEY(server_id, user) );
+        """.format(scores_table_name))
+
+        # Digest of the rewards the scores of each server were computed with, see `ensure_scores`
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS {}(
+        server_id varchar(40) PRIMARY KEY,
+        rewards_digest varchar(64) );
+        """.format(score_sources_table_name))
+
+        # Append-only log of every checked flag. Rows are never updated or deleted
+        self.cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='{}'".format(submissions_table_name))
+        if self.cursor.fetchone() is None:
             self.cursor.execute("""CREATE TABLE {}(
-            user varchar(40),
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
             server_id varchar(40),
+            user varchar(40),
             challenge_name varchar(40),
-            UNIQUE(user, server_id, challenge_name) );
-            """.format(solved_table_name))
+            correct INTEGER,
+            submitted_at REAL );
+            """.format(submissions_table_name))
+            # Solves saved before the log existed are its first entries
+            self.cursor.execute("""INSERT INTO {} (server_id, user, challenge_name, correct, submitted_at)
+                SELECT server_id, user, challenge_name, 1, COALESCE(solved_at, 0) FROM {} ORDER BY id"""
+                                .format(submissions_table_name, solved_table_name))
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS {0}_server_time ON {0} (server_id, submitted_at)"
+                            .format(submissions_table_name))
+
+        # Loading and pruning a server look solves up by these columns
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS {0}_server_user ON {0} (server_id, user)"
+                            .format(solved_table_name))
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS {0}_server_challenge ON {0} (server_id, challenge_name)"
+                            .format(solved_table_name))
 
     def load_solved(self, events, server_id: str) -> None:
         """
@@ -74,23 +157,90 @@ class Database(object):
         """
 
         # Select all challenges solved in the server `server_id`
-        self.cursor.execute("SELECT user, challenge_name FROM {} WHERE server_id='{}'".format(solved_table_name, server_id))
+        self.cursor.execute("SELECT user, challenge_name, solved_at FROM {} WHERE server_id=?"
+                            .format(solved_table_name), (server_id,))
 
         for solved_challenge in self.cursor.fetchall():
             user_id = solved_challenge[0]
             challenge_name = solved_challenge[1]
 
-            # If there is no entry for challenges solved by `user_id`, create one with `challenge_name`
-            # Otherwise, append `challenge_name` to the list
-            if user_id not in events[server_id].solves:
-                events[server_id].solves[user_id] = [challenge_name]
-            else:
-                events[server_id].solves[user_id].append(challenge_name)
+            events[server_id].mark_solved(user_id, challenge_name, solved_challenge[2])
+
+    def load_all_solved(self, events) -> None:
+        """
+        Writes to `events` all challenges solved in every server of `events`, reading only the solves of those servers
+        with a query per `servers_per_query` servers
+
+        Parameters:
+        ----------
+        events: dict[str, Event]:
+            The events dictionary to write data to
+        """
+
+        server_ids = sorted(events)
+        for start in range(0, len(server_ids), servers_per_query):
+            chunk = server_ids[start:start + servers_per_query]
+            self.cursor.execute("SELECT server_id, user, challenge_name, solved_at FROM {} WHERE server_id IN ({}) "
+                                "ORDER BY server_id".format(solved_table_name, ', '.join('?' * len(chunk))), chunk)
+
+            event = None
+            for server_id, user_id, challenge_name, solved_at in self.cursor:
+                if event is None or event.server_id != server_id:
+                    event = events[server_id]
+                event.mark_solved(user_id, challenge_name, solved_at)
+
+    def create_solved_table(self, table_name: str) -> None:
+        """
+        Creates the table of solved challenges `table_name`
+        """
+
+        self.cursor.execute("""CREATE TABLE {}(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user varchar(40),
+        server_id varchar(40),
+        challenge_name varchar(40),
+        solved_at REAL,
+        UNIQUE(user, server_id, challenge_name) );
+        """.format(table_name))
+
+    def last_solve_id(self) -> int:
+        """
+        Returns the id of the newest solved challenge, or 0 if no challenge was solved
+        Solves saved later have a higher id, even once newer solves are deleted, see `load_solves_since`
+        """
+
+        self.cursor.execute("SELECT MAX(id) FROM {}".format(solved_table_name))
+        return self.cursor.fetchone()[0] or 0
+
+    def load_solves_since(self, solve_id: int, server_ids) -> List[tuple]:
+        """
+        Returns a list of (server id, user, challenge name, solve timestamp) tuples of every challenge solved in the
+        servers `server_ids` after the solve with the id `solve_id`, in the order they were saved in each server.
+        Only the solves of those servers are read, with a query per `servers_per_query` servers
+
+        Parameters:
+        ----------
+        solve_id: int
+            ID returned by `last_solve_id`
+        server_ids: Iterable[str]
+            IDs of the servers to read the solves of
+        """
+
+        server_ids = sorted(server_ids)
+        solves = []
+        for start in range(0, len(server_ids), servers_per_query):
+            chunk = server_ids[start:start + servers_per_query]
+            self.cursor.execute("SELECT server_id, user, challenge_name, solved_at FROM {} "
+                                "WHERE id > ? AND server_id IN ({}) ORDER BY id"
+                                .format(solved_table_name, ', '.join('?' * len(chunk))), [solve_id] + chunk)
+            solves.extend(self.cursor.fetchall())
+        return solves
 
     def save_solved_challenges(self, user_solves: Dict[str, List[str]], server_id: str) -> None:
         """
         Updates the database of solved challenges
         The query used does not allow for duplicate entries in the database
+        Does not commit, like every write run by `Storage.write`
 
         Parameters:
         ----------
@@ -101,29 +251,272 @@ class Database(object):
             ID of the server to save
         """
 
-        for member_id, solved_challenges in user_solves.items():
-            for challenge in solved_challenges:
-                self.cursor.execute("INSERT OR IGNORE INTO {} (user, server_id, challenge_name) VALUES ('{}','{}', '{}')".format(solved_table_name, member_id, server_id, challenge))
+        self.cursor.executemany("INSERT OR IGNORE INTO {} (user, server_id, challenge_name) VALUES (?, ?, ?)"
+                                .format(solved_table_name),
+                                ((member_id, server_id, challenge) for member_id, solved_challenges in user_solves.items()
+                                 for challenge in solved_challenges))
 
-        self.connection.commit()
+    def insert_solve(self, member_id: str, server_id: str, challenge_name: str, reward: int = 0,
+                     solved_at: float = None, reward_change: int = 0) -> None:
+        """
+        Saves a single solved challenge to the database and adds its reward to the members' score
+        A solve that was already saved is ignored. Does not commit, like every write run by `Storage.write`
 
-    def remove_redundancies(self, members, challenges) -> None:
+        Parameters:
+        ----------
+        member_id: str
+            ID of the member who solved the challenge
+        server_id: str
+            ID of the server the challenge belongs to
+        challenge_name: str
+            Name of the solved challenge
+        reward: int
+            Number of points awarded for the challenge
+        solved_at: float
+            Timestamp of the solve
+        reward_change: int
+            Number of points added to the score of every other member who solved the challenge,
+            when the solve changed the reward of a dynamic challenge
+        """
+
+        self.cursor.execute("INSERT OR IGNORE INTO {} (user, server_id, challenge_name, solved_at) VALUES (?, ?, ?, ?)"
+                            .format(solved_table_name), (member_id, server_id, challenge_name, solved_at))
+
+        # Solves that were already saved are not scored again
+        if self.cursor.rowcount:
+            if reward_change:
+                # Only the solvers of the challenge are touched, through the server and challenge index
+                self.cursor.execute("""UPDATE {} SET score = score + ? WHERE server_id=? AND user != ? AND user IN (
+                    SELECT user FROM {} WHERE server_id=? AND challenge_name=?)"""
+                                    .format(scores_table_name, solved_table_name),
+                                    (reward_change, server_id, member_id, server_id, challenge_name))
+
+            self.cursor.execute("UPDATE {} SET score = score + ?, last_solve_at = ? WHERE server_id=? AND user=?"
+                                .format(scores_table_name), (reward, solved_at, server_id, member_id))
+            if not self.cursor.rowcount:
+                self.cursor.execute("INSERT INTO {} (server_id, user, score, last_solve_at) VALUES (?, ?, ?, ?)"
+                                    .format(scores_table_name), (server_id, member_id, reward, solved_at))
+
+    def log_submission(self, server_id: str, member_id: str, challenge_name: str, correct: bool,
+                       submitted_at: float) -> None:
+        """
+        Appends a checked flag to the submission log, without committing
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server the flag was submitted to
+        member_id: str
+            ID of the member who submitted the flag
+        challenge_name: str
+            Name of the challenge the flag was checked against, None if the flag matched no challenge
+        correct: bool
+            Whether the flag was correct
+        submitted_at: float
+            Timestamp of the submission
+        """
+
+        self.cursor.execute("INSERT INTO {} (server_id, user, challenge_name, correct, submitted_at) "
+                            "VALUES (?, ?, ?, ?, ?)".format(submissions_table_name),
+                            (server_id, member_id, challenge_name, int(correct), submitted_at))
+
+    def load_submissions(self, server_id: str, until: float = None, correct_only: bool = False) -> List[tuple]:
+        """
+        Returns a list of (user, challenge name, correct, timestamp) tuples of the submissions to the server,
+        in the order they were made
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server
+        until: float
+            Only submissions made up to this timestamp are returned if given
+        correct_only: bool
+            Whether only correct submissions are returned
+        """
+
+        query = "SELECT user, challenge_name, correct, submitted_at FROM {} WHERE server_id=? AND submitted_at<=?" \
+            .format(submissions_table_name)
+        if correct_only:
+            query += " AND correct"
+        self.cursor.execute(query + " ORDER BY submitted_at, id", (server_id, float('inf') if until is None else until))
+        return self.cursor.fetchall()
+
+    def load_solve_log(self, server_id: str, after_id: int = 0) -> List[tuple]:
+        """
+        Returns a list of (submission id, user, challenge name, timestamp) tuples of the correct submissions to
+        the server logged after the submission with the id `after_id`, in the order they were logged
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server
+        after_id: int
+            ID of the newest submission already read
+        """
+
+        self.cursor.execute("SELECT id, user, challenge_name, submitted_at FROM {} "
+                            "WHERE server_id=? AND id>? AND correct ORDER BY id".format(submissions_table_name),
+                            (server_id, after_id))
+        return self.cursor.fetchall()
+
+    def load_scores(self, server_id: str) -> List[tuple]:
+        """
+        Returns a list of (user, score, last solve timestamp) tuples of every member with a score in the server
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server
+        """
+
+        self.cursor.execute("SELECT user, score, last_solve_at FROM {} WHERE server_id=?".format(scores_table_name),
+                            (server_id,))
+        return self.cursor.fetchall()
+
+    def ensure_scores(self, server_id: str, scoring: Dict[str, tuple]) -> bool:
+        """
+        Rebuilds the scores of the server if they were computed with other challenges than `scoring`,
+        or if solves were removed since
+        Returns True if the scores were rebuilt
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server
+        scoring: dict[str, tuple]
+            Key is challenge name
+            Value is the `challenge_scoring` of the challenge
+        """
+
+        self.cursor.execute("SELECT rewards_digest FROM {} WHERE server_id=?".format(score_sources_table_name),
+                            (server_id,))
+        row = self.cursor.fetchone()
+        if row is not None and row[0] == self.rewards_digest(scoring):
+            return False
+
+        self.rebuild_scores(server_id, scoring)
+        return True
+
+    def rebuild_scores(self, server_id: str, scoring: Dict[str, tuple]) -> int:
+        """
+        Recomputes the scores of the server from its solved challenges and returns the number of scored members
+        Does not commit, like every write run by `Storage.write`
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server
+        scoring: dict[str, tuple]
+            Key is challenge name
+            Value is the `challenge_scoring` of the challenge
+        """
+
+        self.cursor.execute("SELECT challenge_name, COUNT(*) FROM {} WHERE server_id=? GROUP BY challenge_name"
+                            .format(solved_table_name), (server_id,))
+        rewards = self.current_rewards(scoring, dict(self.cursor.fetchall()))
+
+        self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS rewards (challenge_name varchar(40) PRIMARY KEY, "
+                            "reward INTEGER)")
+        self.cursor.execute("DELETE FROM temp.rewards")
+        self.cursor.executemany("INSERT INTO temp.rewards (challenge_name, reward) VALUES (?, ?)", rewards.items())
+
+        self.cursor.execute("DELETE FROM {} WHERE server_id=?".format(scores_table_name), (server_id,))
+        self.cursor.execute("""INSERT INTO {} (server_id, user, score, last_solve_at)
+            SELECT solved.server_id, solved.user, SUM(rewards.reward), MAX(solved.solved_at)
+            FROM {} AS solved JOIN temp.rewards AS rewards ON rewards.challenge_name = solved.challenge_name
+            WHERE solved.server_id=? GROUP BY solved.user""".format(scores_table_name, solved_table_name),
+                            (server_id,))
+        scored = self.cursor.rowcount
+
+        self.cursor.execute("INSERT OR REPLACE INTO {} (server_id, rewards_digest) VALUES (?, ?)"
+                            .format(score_sources_table_name), (server_id, self.rewards_digest(scoring)))
+        return scored
+
+    @staticmethod
+    def current_rewards(scoring: Dict[str, tuple], solve_counts: Dict[str, int]) -> Dict[str, int]:
+        """
+        Returns a dictionary of the reward of every challenge of `scoring` once it has the solves of `solve_counts`
+        """
+
+        return {name: dynamic_reward(*fields, solve_counts.get(name, 0)) for name, fields in scoring.items()}
+
+    @staticmethod
+    def rewards_digest(scoring: Dict[str, tuple]) -> str:
+        """
+        Returns a digest identifying the challenges `scoring`
+        """
+
+        data = '\n'.join('{}|{}'.format(name, '|'.join(str(field) for field in fields))
+                         for name, fields in sorted(scoring.items()))
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def invalidate_scores(self, server_id: str) -> None:
+        """
+        Makes the next `ensure_scores` of the server rebuild its scores
+        Removing solves can change the reward of dynamic challenges, and so the score of their other solvers
+        """
+
+        self.cursor.execute("DELETE FROM {} WHERE server_id=?".format(score_sources_table_name), (server_id,))
+
+    def load_challenge_solves(self, server_id: str, challenge_names) -> List[tuple]:
+        """
+        Returns a list of (user, challenge name, solve timestamp) tuples of the stored solves of the given challenges
+        in the server `server_id`
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server
+        challenge_names: Iterable[str]
+            Names of the challenges
+        """
+
+        solves = []
+        for challenge_name in challenge_names:
+            self.cursor.execute("SELECT user, challenge_name, solved_at FROM {} WHERE server_id=? AND challenge_name=?"
+                                .format(solved_table_name), (server_id, challenge_name))
+            solves.extend(self.cursor.fetchall())
+        return solves
+
+    def remove_redundancies(self, server_id: str, members, challenges) -> None:
         """
         Removes from the database entries of solved challenges by users no longer in the server
         Removes from the database entries of solved challenges no longer defined in the server
+        Only entries of the server with the id `server_id` are removed
+        Does not commit, like every write run by `Storage.write`
 
         Parameters:
         ----------
+        server_id: str
+            ID of the server to prune
         members: Iterable[discord.Member]
             Iterable of members in the server whose records should remain in the DB
         challenges: Iterable[Challenge]
-            Iterable of challenges that should remain in the DB
+            Iterable of challenges (or challenge names) that should remain in the DB
         """
 
-        user_list = ", ".join(map(lambda user: repr(user.id), members))
-        challenge_list = ", ".join(map(lambda challenge: repr(challenge), challenges))
+        # The rows to keep are loaded into temporary tables, so the deletes are indexed anti-joins
+        self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS keep_users (user varchar(40) PRIMARY KEY)")
+        self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS keep_challenges (challenge_name varchar(40) PRIMARY KEY)")
+        self.cursor.execute("DELETE FROM temp.keep_users")
+        self.cursor.execute("DELETE FROM temp.keep_challenges")
 
-        self.cursor.execute("DELETE FROM {} WHERE user NOT IN ({})".format(solved_table_name, user_list))
-        self.cursor.execute("DELETE FROM {} WHERE challenge_name NOT IN ({})".format(solved_table_name, challenge_list))
+        self.cursor.executemany("INSERT OR IGNORE INTO temp.keep_users (user) VALUES (?)",
+                                ((member.id,) for member in members))
+        self.cursor.executemany("INSERT OR IGNORE INTO temp.keep_challenges (challenge_name) VALUES (?)",
+                                ((str(challenge),) for challenge in challenges))
 
-        self.connection.commit()
+        self.cursor.execute("""DELETE FROM {0} WHERE server_id=? AND NOT EXISTS (
+            SELECT 1 FROM temp.keep_users WHERE keep_users.user = {0}.user)""".format(solved_table_name),
+                            (server_id,))
+        removed = self.cursor.rowcount
+        self.cursor.execute("""DELETE FROM {0} WHERE server_id=? AND NOT EXISTS (
+            SELECT 1 FROM temp.keep_challenges WHERE keep_challenges.challenge_name = {0}.challenge_name)"""
+                            .format(solved_table_name), (server_id,))
+        removed += self.cursor.rowcount
+        if removed:
+            self.invalidate_scores(server_id)
+        self.cursor.execute("""DELETE FROM {0} WHERE server_id=? AND NOT EXISTS (
+            SELECT 1 FROM temp.keep_users WHERE keep_users.user = {0}.user)""".format(scores_table_name),
+                            (server_id,))
@@ -1,94 +1,253 @@
+import argparse
 import discord
-from bot import Bot
-import sys
+from bot import Bot, stats_file, snapshot_file
+from db_handler import Database
+from scheduler import PRIORITY_DM
+from shards import ShardSupervisor, shard_file
+import time
 
-token_path = 'token.txt'
-if len(sys.argv) > 1:
-    token_path = sys.argv[1]
 
-with open(token_path) as token_file:
-    token = token_file.read().strip('\n')
+def register_events(bot: Bot) -> Bot:
+    """
+    Registers the event handlers of the bot on `bot` and returns it
+    """
 
-bot = Bot()
+    @bot.event
+    async def on_ready() -> None:
+        """
+        From discord.py documentation:
+        ```
+        Called when the client is done preparing the data received from Discord. Usually after login is successful and the
+        Client.servers and co. are filled up.
+        ```
+        """
+        print('Logged in as')
+        print(bot.user.name)
+        print(bot.user.id)
+        print('------')
 
+        bot.start_stats_export()
+        bot.start_challenge_watch()
+        start = time.monotonic()
 
-@bot.event
-async def on_ready() -> None:
-    """
-    From discord.py documentation:
-    ```
-    Called when the client is done preparing the data received from Discord. Usually after login is successful and the
-    Client.servers and co. are filled up.
-    ```
-    """
-    print('Logged in as')
-    print(bot.user.name)
-    print(bot.user.id)
-    print('------')
+        servers = list(bot.servers)
+        await bot.load_all_modules(servers)
+        print('Loaded {} servers in {:.2f}s'.format(len(servers), time.monotonic() - start))
+        bot.start_snapshots()
 
-    for server in bot.servers:
-        await bot.load_modules(server)
-        await bot.update_challenge_board(server.id)
-        await bot.update_score_board(server.id)
+        await bot.publish_all_boards(servers)
+        print('Ready in {:.2f}s'.format(time.monotonic() - start))
 
+    @bot.event
+    async def on_member_update(before: discord.Member, after: discord.Member) -> None:
+        """
+        Called when a member changed, e.g. their nickname. Their name is looked up again on the next scoreboard update
+        """
+        if before.display_name != after.display_name:
+            bot.display_names.invalidate(after.server.id, after.id)
 
-@bot.event
-async def on_member_join(member: discord.Member) -> None:
-    """
-    Called when someone has joined the server(New blood)
-    """
-    event = bot.events[member.server.id]
-    event.scoreboard.add_participant(member)
+    @bot.event
+    async def on_channel_create(channel: discord.Channel) -> None:
+        """
+        Called whenever a channel is created, the board channels of its server are resolved again
+        """
+        if not channel.is_private:
+            bot.refresh_channels(channel.server)
 
+    @bot.event
+    async def on_channel_delete(channel: discord.Channel) -> None:
+        """
+        Called whenever a channel is deleted, the board channels of its server are resolved again
+        """
+        if not channel.is_private:
+            bot.refresh_channels(channel.server)
 
-@bot.event
-async def on_message(message: discord.Message) -> None:
-    """
-    Called whenever a message was sent in one of the servers the bot is in
-    If the message was a PM this method checks if it was a flag submission and it verifiers the solution
-    If the message was a global message this method checks if the sender is an admin that requested a reload of the bot
-    """
-    if message.author.bot:
-        return
-    if message.channel.is_private:
-        # Answer format: <challenge name>:<flag>#<server ID>
-        try:
-            answer, server_id = message.content.split('#')
-            challenge_name, flag = answer.replace(' ', '').split(':')
-        except ValueError as e:
-            print(e)
-            await bot.send_message(message.channel,
-                                   '{} Please send your answer in the following format: '
-                                   '<challenge name>:<flag>#SERVER_ID'.format(message.author.mention))
-        else:
-
-            if server_id not in bot.events:
-                await bot.send_message(message.channel, "{} This bot is not in the server with the ID {}".format(message.author.mention, server_id))
+    @bot.event
+    async def on_channel_update(before: discord.Channel, after: discord.Channel) -> None:
+        """
+        Called whenever a channel is changed, e.g. renamed. The board channels of its server are resolved again
+        """
+        if not after.is_private and before.name != after.name:
+            bot.refresh_channels(after.server)
+
+    @bot.event
+    async def on_message(message: discord.Message) -> None:
+        """
+        Called whenever a message was sent in one of the servers the bot is in
+        If the message was a PM this method checks if it was a flag submission and it verifiers the solution
+        If the message was a global message this method checks if the sender is an admin that requested a reload of the bot
+        """
+        if message.author.bot:
+            return
+        if message.channel.is_private:
+            if not bot.member_limiter.allow(message.author.id):
+                bot.stats.increment(bot.stats.global_server_id, 'throttled_submissions')
+                if bot.member_limiter.notify(message.author.id):
+                    bot.queue_message(message.channel,
+                                      '{} You are sending flags too fast, try again in a few seconds'
+                                      .format(message.author.mention),
+                                      priority=PRIORITY_DM)
                 return
 
-            event = bot.events[server_id]
-            challenge = event.check_answer(flag, challenge_name)
-            # Correct answer
-            if challenge:
-                if event.add_points(message.author, challenge):
-                    await bot.send_message(message.channel,
-                                           '{} Correct! Here are {} points'.format(message.author.mention,
-                                                                                   challenge.reward))
-                    bot.save_events()
-                    await bot.update_score_board(server_id)
-                    await bot.update_answer_feed(server_id, challenge, message.author)
+            # Answer format: <challenge name>:<flag>#<server ID> or <flag>#<server ID>
+            start = time.perf_counter()
+            try:
+                answer, server_id = message.content.split('#')
+                answer = answer.replace(' ', '')
+                if ':' in answer:
+                    challenge_name, flag = answer.split(':')
                 else:
-                    await bot.send_message(message.channel,
-                                           '{} You already solved this challenge!'.format(message.author.mention))
+                    challenge_name, flag = None, answer
+            except ValueError as e:
+                print(e)
+                bot.stats.increment(bot.stats.global_server_id, 'malformed_submissions')
+                bot.queue_message(message.channel,
+                                  '{} Please send your answer in the following format: '
+                                  '<challenge name>:<flag>#SERVER_ID'.format(message.author.mention),
+                                  priority=PRIORITY_DM)
             else:
-                await bot.send_message(message.channel,
-                                       '{} Incorrect flag or there is no such challenge :('.format(
-                                           message.author.mention))
-    elif message.content == '!reload':
-        if message.author.server.owner.top_role in message.author.roles:
-            bot.save_events()
-            await bot.load_modules(message.server)
-            await bot.update_challenge_board(message.server.id)
-            await bot.update_score_board(message.server.id)
-
-bot.run(token)
+
+                if server_id not in bot.events:
+                    bot.queue_message(message.channel, "{} This bot is not in the server with the ID {}".format(message.author.mention, server_id),
+                                      priority=PRIORITY_DM)
+                    return
+
+                if not bot.server_limiter.allow(server_id):
+                    bot.stats.increment(server_id, 'throttled_submissions')
+                    if bot.server_limiter.notify(message.author.id):
+                        bot.queue_message(message.channel,
+                                          '{} The server is receiving too many flags, try again in a few seconds'
+                                          .format(message.author.mention),
+                                          priority=PRIORITY_DM)
+                    return
+
+                bot.stats.observe(server_id, 'parse', time.perf_counter() - start)
+                bot.stats.increment(server_id, 'submissions')
+
+                challenge, solved, saved = await bot.actor(server_id).send(
+                    lambda: bot.judge_submission(server_id, message.author, flag, challenge_name))
+                # Correct answer
+                if challenge:
+                    if solved:
+                        # Only confirm the solve once it is stored. A solve that could not be stored is undone
+                        try:
+                            with bot.stats.timer(server_id, 'save_solve'):
+                                await saved
+                        except Exception as e:
+                            print(e)
+                            bot.queue_message(message.channel,
+                                              '{} Your flag is correct, but it could not be saved. Please send it again'
+                                              .format(message.author.mention),
+                                              priority=PRIORITY_DM)
+                            return
+                        rank = bot.events[server_id].scoreboard.get_rank(message.author.id)
+                        bot.queue_message(message.channel,
+                                          '{} Correct! Here are {} points, you are now ranked #{}'
+                                          .format(message.author.mention, challenge.reward, rank),
+                                          priority=PRIORITY_DM)
+                        bot.publish_solve(server_id, challenge, message.author)
+                    else:
+                        bot.queue_message(message.channel,
+                                          '{} You already solved this challenge!'.format(message.author.mention),
+                                          priority=PRIORITY_DM)
+                else:
+                    bot.queue_message(message.channel,
+                                      '{} Incorrect flag or there is no such challenge :('.format(
+                                          message.author.mention),
+                                      priority=PRIORITY_DM)
+        elif message.content == '!reload':
+            if message.author.server.owner.top_role in message.author.roles:
+                # Every solve is already saved when it is made
+                await bot.actor(message.server.id).send(lambda: bot.load_modules(message.server))
+                await bot.update_challenge_board(message.server.id)
+                await bot.update_score_board(message.server.id)
+        elif message.content == '!rebuild':
+            if message.author.server.owner.top_role in message.author.roles:
+                mismatches = await bot.actor(message.server.id).send(lambda: bot.rebuild_scores(message.server.id))
+                bot.schedule_board_update(message.server.id, 'score')
+                bot.queue_message(message.channel, 'Rebuilt the scores from the solved challenges, '
+                                                   '{} members had a different score'.format(mismatches))
+        elif message.content.startswith('!scoreboard '):
+            if message.author.server.owner.top_role in message.author.roles:
+                try:
+                    until = float(message.content.split(' ', 1)[1])
+                    title = 'Scoreboard at {}'.format(time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(until)))
+                except (ValueError, OverflowError, OSError) as e:
+                    print(e)
+                    bot.queue_message(message.channel, 'Usage: !scoreboard <unix timestamp>')
+                    return
+                scoreboard = await bot.scoreboard_at(message.server.id, until)
+                pages = scoreboard.get_pages(bot.scoreboard_rows_per_page, bot.embed_description_limit, True, 1,
+                                             bot.display_names.name_of(message.server))
+                bot.queue_message(message.channel, embed=discord.Embed(
+                    title=title, description=pages[0] if pages else 'No points were scored yet', color=0x38bc35))
+        elif message.content == '!replay':
+            if message.author.server.owner.top_role in message.author.roles:
+                replayed = await bot.replay_event(message.server.id)
+                scores = bot.events[message.server.id].scoreboard.participants
+                replayed_scores = replayed.scoreboard.participants
+                mismatches = sum(1 for member_id in set(scores) | set(replayed_scores)
+                                 if scores.get(member_id, 0) != replayed_scores.get(member_id, 0))
+                bot.queue_message(message.channel, 'Replayed the submission log, {} members had a different score'
+                                  .format(mismatches))
+        elif message.content == '!solves' or message.content.startswith('!solves '):
+            if message.author.server.owner.top_role in message.author.roles:
+                event = bot.events[message.server.id]
+                argument = message.content[len('!solves '):].strip()
+                challenge = event.challenges.get(argument)
+                if challenge is not None:
+                    lines = ['{} UTC: {}'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(solved_at)), count)
+                             for solved_at, count in event.solve_curve(challenge)]
+                    title = 'Solves of {}'.format(challenge.name)
+                else:
+                    try:
+                        until = float(argument) if argument else None
+                        title = 'Solves' if until is None else 'Solves at {}'.format(
+                            time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(until)))
+                    except (ValueError, OverflowError, OSError) as e:
+                        print(e)
+                        bot.queue_message(message.channel, 'Usage: !solves [<unix timestamp> | <challenge name>]')
+                        return
+                    lines = ['{}: {}'.format(name, event.solve_count(challenge, until))
+                             for name, challenge in event.challenges.items()]
+                description = '\n'.join(lines) or 'Nothing was solved yet'
+                bot.queue_message(message.channel, embed=discord.Embed(
+                    title=title, description=description[:bot.embed_description_limit], color=0x38bc35))
+        elif message.content == '!stats':
+            if message.author.server.owner.top_role in message.author.roles:
+                bot.stats.export_prometheus(bot.stats_file)
+                bot.queue_message(message.channel, bot.stats.render(message.server.id))
+
+    return bot
+
+
+def run_shard(shard_id: int, shard_count: int, token: str) -> None:
+    """
+    Runs the shard `shard_id` out of `shard_count` shards, which only serves the servers discord assigns to it
+    Shards share the database, every shard has its own snapshot and statistics file
+    """
+
+    register_events(Bot(stats_file=shard_file(stats_file, shard_id), snapshot_file=shard_file(snapshot_file, shard_id),
+                        shard_id=shard_id, shard_count=shard_count)).run(token)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CTF Bot for Discord')
+    parser.add_argument('token_path', nargs='?', default='token.txt')
+    parser.add_argument('--shards', type=int, default=1, help='number of shard processes')
+    args = parser.parse_args()
+
+    with open(args.token_path) as token_file:
+        token = token_file.read().strip('\n')
+
+    if args.shards > 1:
+        # Tables are created once, before the shards open the database
+        with Database() as db:
+            db.check_create_tables()
+            db.connection.commit()
+
+        ShardSupervisor(run_shard, args.shards, (token,),
+                        stats_files=[shard_file(stats_file, shard_id) for shard_id in range(args.shards)],
+                        stats_file=stats_file).run()
+    else:
+        register_events(Bot()).run(token)
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+
+class DisplayNames(object):
+    """
+    Least recently used cache of the display names of members
+    Scoreboards only hold member ids, so names are only looked up for the rows that are rendered
+
+    Attributes:
+    ----------
+    max_size: int
+        Maximum number of names remembered
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._names = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def get(self, server, member_id: str) -> str:
+        """
+        Returns the display name of the member with the id `member_id` in `server`,
+        or None if they are not in the server or are a bot
+
+        Parameters:
+        ----------
+        server: `discord.Server`
+            The server of the member
+        member_id: str
+            ID of the member
+        """
+
+        key = (server.id, member_id)
+        name = self._names.get(key)
+        if name is not None:
+            self._names.move_to_end(key)
+            return name
+
+        # Members who are not found are not remembered, so they show up again if they come back
+        member = server.get_member(member_id)
+        if member is None or member.bot:
+            return None
+
+        name = member.display_name
+        self._names[key] = name
+        if len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+        return name
+
+    def name_of(self, server):
+        """
+        Returns a function that looks up the display name of a member id in `server`, see `Scoreboard.get_pages`
+        """
+
+        return lambda member_id: self.get(server, member_id)
+
+    def invalidate(self, server_id: str, member_id: str) -> None:
+        """
+        Forgets the display name of the member with the id `member_id` in the server with the id `server_id`
+        """
+
+        self._names.pop((server_id, member_id), None)
@@ -0,0 +1,97 @@
+import json
+
+# Name of the channel of every board, unless the server overrides it
+default_channel_names = {'challenges': 'challenges', 'scoreboard': 'scoreboard', 'feed': 'feed'}
+
+
+def load_channel_names(p: str) -> dict:
+    """
+    Returns the channel name overrides of the file `p`, or an empty dict if there is no such file
+    File format, a JSON object keyed by server id:
+    {"<server ID>": {"challenges": "<name>", "scoreboard": "<name>", "feed": "<name>"}}
+    Boards that are left out keep their default channel name
+    """
+
+    try:
+        with open(p) as file:
+            overrides = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print('Invalid channel names file: {}'.format(e))
+        return {}
+
+    return {server_id: {board: name for board, name in names.items() if board in default_channel_names}
+            for server_id, names in overrides.items()}
+
+
+class ChannelRouter(object):
+    """
+    Class that resolves the channel of every board of a server once, and keeps it until the channels change
+
+    Attributes:
+    ----------
+    overrides: dict
+        Key is server id
+        Value is a dict mapping board to the name of its channel in the server, see `load_channel_names`
+    """
+
+    def __init__(self, overrides=None):
+        self.overrides = overrides or {}
+        self._routes = {}
+
+    def channel_names(self, server_id: str) -> dict:
+        """
+        Returns a dict mapping every board to the name of its channel in the server with the id `server_id`
+        """
+
+        names = dict(default_channel_names)
+        names.update(self.overrides.get(server_id, {}))
+        return names
+
+    def resolve(self, server) -> dict:
+        """
+        Resolves the channels of `server` with a single scan of its channels
+        Returns a dict mapping every board to its channel, boards without a channel are left out
+
+        Parameters:
+        ----------
+        server: `discord.Server`
+            The server to resolve
+        """
+
+        boards = {name.lower(): board for board, name in self.channel_names(server.id).items()}
+        routes = {}
+        for channel in server.channels:
+            board = boards.get(channel.name.lower())
+            # The first channel of a name wins, like the scans this replaces
+            if board is not None and board not in routes:
+                routes[board] = channel
+
+        self._routes[server.id] = routes
+        return routes
+
+    def get(self, server, board: str):
+        """
+        Returns the channel of `board` in `server`, or None if the server has no such channel
+
+        Parameters:
+        ----------
+        server: `discord.Server`
+            The server of the board
+        board: str
+            One of `default_channel_names`
+        """
+
+        routes = self._routes.get(server.id)
+        if routes is None:
+            routes = self.resolve(server)
+        return routes.get(board)
+
+    def invalidate(self, server_id: str) -> dict:
+        """
+        Forgets the channels of the server with the id `server_id`, so they are resolved again on their next use
+        Returns the forgotten routes
+        """
+
+        return self._routes.pop(server_id, {})
@@ -0,0 +1,261 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+# Priority classes of outbound requests, lower is sent first
+PRIORITY_DM = 0
+PRIORITY_FEED = 1
+PRIORITY_BOARD = 2
+
+
+class TokenBucket(object):
+    """
+    Class representing a token bucket used to pace requests
+
+    Attributes:
+    ----------
+    rate: float
+        Number of tokens added every second
+    capacity: float
+        Maximum number of tokens in the bucket, i.e. the size of a burst
+    tokens: float
+        Number of tokens currently in the bucket
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        Returns the number of seconds until a token is available
+        """
+
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        """
+        Takes a token from the bucket
+        """
+
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        """
+        Returns True if the bucket has refilled to its capacity, so it is no different from a new bucket
+        """
+
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job(object):
+    __slots__ = ('priority', 'seq', 'channel_id', 'factory', 'future', 'key')
+
+    def __init__(self, priority, seq, channel_id, factory, future, key):
+        self.priority = priority
+        self.seq = seq
+        self.channel_id = channel_id
+        self.factory = factory
+        self.future = future
+        self.key = key
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler(object):
+    """
+    Class that sends every outbound discord request of the bot
+
+    Each channel has its own queue and token bucket, and every request also takes a token from a global bucket.
+    Requests of a channel run one at a time, in order of priority and then submission.
+    Whenever a token is free, the most urgent request of a channel that can send is run, so a reply to a
+    solver never waits behind board updates of another channel.
+    The bucket of a channel is dropped once its queue is empty and it has refilled, so only channels that sent
+    recently are tracked.
+
+    Attributes:
+    ----------
+    channel_rate: float
+        Number of requests per second allowed in a single channel
+    channel_burst: int
+        Number of requests a channel may send at once
+    global_rate: float
+        Number of requests per second allowed overall
+    global_burst: int
+        Number of requests that may be sent at once overall
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, channel_rate=1.0, channel_burst=5,
+                 global_rate=45.0, global_burst=45):
+        self.loop = loop
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._buckets = {}
+        self._queues = {}
+        self._busy = set()
+        self._keyed = {}
+        self._seq = itertools.count()
+        self._evicted_at = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, channel, factory, priority: int, key=None) -> asyncio.Future:
+        """
+        Queues a request and returns a future of its result
+
+        Parameters:
+        ----------
+        channel: `discord.Channel`
+            The channel the request is made to
+        factory: Callable[[], Awaitable]
+            Function that makes the request when called
+        priority: int
+            One of the PRIORITY_* classes
+        key: Hashable
+            Requests sharing a key supersede each other. If a request with the same key is still waiting,
+            it is replaced by this one and both callers get the result of this request
+        """
+
+        if key is not None and key in self._keyed:
+            job = self._keyed[key]
+            job.factory = factory
+            return job.future
+
+        job = _Job(priority, next(self._seq), channel.id, factory, self.loop.create_future(), key)
+        if key is not None:
+            self._keyed[key] = job
+
+        heapq.heappush(self._queues.setdefault(channel.id, []), job)
+        if channel.id not in self._buckets:
+            self._buckets[channel.id] = TokenBucket(self.channel_rate, self.channel_burst)
+
+        if self._dispatcher is None:
+            self._dispatcher = self.loop.create_task(self._dispatch())
+        self._wakeup.set()
+        return job.future
+
+    def stop(self) -> None:
+        """
+        Stops sending requests. Requests that are still waiting are cancelled
+        """
+
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+        self._queues.clear()
+        self._keyed.clear()
+
+    @property
+    def evict_interval(self) -> float:
+        """
+        Number of seconds an empty bucket of a channel takes to refill, buckets are checked for eviction this often
+        """
+
+        return self.channel_burst / self.channel_rate
+
+    def _evict_buckets(self, now: float) -> None:
+        """
+        Drops the buckets of the channels with no queued or running request that have refilled
+        """
+
+        for channel_id in [channel_id for channel_id, bucket in self._buckets.items()
+                           if channel_id not in self._queues and channel_id not in self._busy
+                           and bucket.is_full(now)]:
+            del self._buckets[channel_id]
+        self._evicted_at = now
+
+    def _next_job(self, now: float):
+        """
+        Returns the most urgent job that can be sent now, and the number of seconds to wait if there is none
+        """
+
+        best = None
+        wait = None
+
+        for channel_id, queue in self._queues.items():
+            if not queue or channel_id in self._busy:
+                continue
+
+            head = queue[0]
+            delay = self._buckets[channel_id].delay(now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif best is None or head < best:
+                best = head
+
+        return best, wait
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            if now - self._evicted_at >= self.evict_interval:
+                self._evict_buckets(now)
+
+            job, wait = self._next_job(now)
+            if job is None:
+                if self._buckets and wait is None:
+                    wait = self.evict_interval
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._global_bucket.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            self._global_bucket.take(now)
+            self._buckets[job.channel_id].take(now)
+
+            queue = self._queues[job.channel_id]
+            heapq.heappop(queue)
+            if not queue:
+                del self._queues[job.channel_id]
+            if job.key is not None:
+                del self._keyed[job.key]
+
+            self._busy.add(job.channel_id)
+            self.loop.create_task(self._run(job))
+
+    async def _run(self, job: _Job) -> None:
+        try:
+            result = await job.factory()
+        except Exception as e:
+            print(e)
+            if not job.future.done():
+                job.future.set_exception(e)
+                # The error is already reported, callers that do not wait for the result should not report it again
+                job.future.exception()
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._busy.discard(job.channel_id)
+            self._wakeup.set()
@@ -0,0 +1,221 @@
+import multiprocessing
+import os
+import time
+
+
+def shard_of(server_id: str, shard_count: int) -> int:
+    """
+    Returns the shard that discord connects the server with the id `server_id` to, out of `shard_count` shards
+    """
+
+    return (int(server_id) >> 22) % shard_count
+
+
+def shard_file(p: str, shard_id: int) -> str:
+    """
+    Returns the path of the file `p` of the shard `shard_id`, e.g. ctfbot.shard0.prom for ctfbot.prom
+    """
+
+    root, extension = os.path.splitext(p)
+    return '{}.shard{}{}'.format(root, shard_id, extension)
+
+
+def merge_prometheus(stats_files, p: str) -> int:
+    """
+    Merges the Prometheus text files `stats_files` of the shards into the file `p`, with the shard of every sample
+    as its `shard` label. Files that do not exist yet are skipped
+    Returns the number of merged files
+
+    Parameters:
+    ----------
+    stats_files: list[str]
+        The file of every shard, indexed by shard id, see `Stats.export_prometheus`
+    p: str
+        Path of the merged file
+    """
+
+    # Key is metric name, value is a (comments, samples) tuple. Samples of a metric have to be kept together
+    metrics = {}
+    merged = 0
+    for shard_id, stats_file in enumerate(stats_files):
+        try:
+            with open(stats_file) as file:
+                lines = file.read().splitlines()
+        except OSError:
+            continue
+
+        merged += 1
+        comments, samples = None, None
+        for line in lines:
+            if line.startswith('# HELP '):
+                comments, samples = metrics.setdefault(line.split(' ')[2], ([], []))
+                if not comments:
+                    comments.append(line)
+            elif line.startswith('# '):
+                if len(comments) < 2:
+                    comments.append(line)
+            elif line and samples is not None:
+                samples.append(line.replace('{', '{{shard="{}",'.format(shard_id), 1))
+
+    lines = []
+    for comments, samples in metrics.values():
+        lines.extend(comments)
+        lines.extend(samples)
+
+    tmp_p = p + '.tmp'
+    with open(tmp_p, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.replace(tmp_p, p)
+    return merged
+
+
+class ShardSupervisor(object):
+    """
+    Class that runs every shard of the bot in a process of its own, restarts the shards that crash
+    and collects their statistics
+
+    A shard that exits with an exit code other than 0 is restarted after `restart_delay` seconds.
+    The delay doubles with every crash in a row, up to `max_restart_delay`, and is reset once the shard runs for
+    `stable_after` seconds
+
+    Attributes:
+    ----------
+    target: Callable[[int, int, ...], None]
+        Function that runs a shard, called in the process of the shard with the shard id, the shard count and `args`
+    shard_count: int
+        Number of shards
+    args: tuple
+        Extra arguments of `target`
+    stats_files: list[str]
+        The statistics file of every shard, indexed by shard id. None if the statistics are not collected
+    stats_file: str
+        File the statistics of every shard are merged into every `stats_interval` seconds, see `merge_prometheus`
+    max_restarts: int
+        Number of times a shard is restarted before it is given up on, None to always restart it
+    restarts: list[int]
+        Number of times each shard was restarted
+    exit_codes: list[int]
+        Exit code of the last run of each shard, None while it runs
+    """
+
+    restart_delay = 1.0
+    max_restart_delay = 60.0
+    stable_after = 60.0
+    poll_interval = 0.5
+    stats_interval = 15.0
+
+    def __init__(self, target, shard_count: int, args=(), stats_files=None, stats_file=None, max_restarts=None):
+        self.target = target
+        self.shard_count = shard_count
+        self.args = args
+        self.stats_files = stats_files
+        self.stats_file = stats_file
+        self.max_restarts = max_restarts
+
+        self.restarts = [0] * shard_count
+        self.exit_codes = [None] * shard_count
+        self._processes = [None] * shard_count
+        self._started_at = [0.0] * shard_count
+        self._crashes = [0] * shard_count
+        # Time each crashed shard is restarted at, keyed by shard id
+        self._pending = {}
+
+    def start(self) -> None:
+        """
+        Starts every shard
+        """
+
+        for shard_id in range(self.shard_count):
+            self.start_shard(shard_id)
+
+    def start_shard(self, shard_id: int) -> None:
+        """
+        Starts the process of the shard `shard_id`
+        """
+
+        process = multiprocessing.Process(target=self.target, args=(shard_id, self.shard_count) + tuple(self.args),
+                                          name='ctfbot-shard{}'.format(shard_id))
+        process.start()
+        self._processes[shard_id] = process
+        self._started_at[shard_id] = time.monotonic()
+        self.exit_codes[shard_id] = None
+
+    def poll(self) -> bool:
+        """
+        Schedules the restart of the shards that crashed since the last call and restarts the shards that are due
+        Returns True while any shard is running or waiting to be restarted
+        """
+
+        now = time.monotonic()
+        for shard_id, process in enumerate(self._processes):
+            if process is None or process.exitcode is None:
+                continue
+
+            self._processes[shard_id] = None
+            self.exit_codes[shard_id] = process.exitcode
+            if process.exitcode == 0:
+                continue
+
+            if now - self._started_at[shard_id] >= self.stable_after:
+                self._crashes[shard_id] = 0
+            self._crashes[shard_id] += 1
+            if self.max_restarts is not None and self.restarts[shard_id] >= self.max_restarts:
+                print('Shard {} exited with code {}, giving up on it'.format(shard_id, process.exitcode))
+                continue
+
+            delay = min(self.restart_delay * 2 ** (self._crashes[shard_id] - 1), self.max_restart_delay)
+            print('Shard {} exited with code {}, restarting it in {:g}s'.format(shard_id, process.exitcode, delay))
+            self._pending[shard_id] = now + delay
+
+        for shard_id, restart_at in list(self._pending.items()):
+            if restart_at <= now:
+                del self._pending[shard_id]
+                self.restarts[shard_id] += 1
+                self.start_shard(shard_id)
+
+        return bool(self._pending) or any(process is not None for process in self._processes)
+
+    def collect_stats(self) -> None:
+        """
+        Merges the statistics files of the shards into `self.stats_file`
+        """
+
+        if self.stats_files is None or self.stats_file is None:
+            return
+        try:
+            merge_prometheus(self.stats_files, self.stats_file)
+        except OSError as e:
+            print(e)
+
+    def run(self) -> None:
+        """
+        Starts every shard and supervises them until every shard exited without crashing or was given up on
+        Stops the shards on KeyboardInterrupt
+        """
+
+        self.start()
+        collected_at = time.monotonic()
+        try:
+            while self.poll():
+                time.sleep(self.poll_interval)
+                if time.monotonic() - collected_at >= self.stats_interval:
+                    self.collect_stats()
+                    collected_at = time.monotonic()
+        except KeyboardInterrupt:
+            self.stop()
+        self.collect_stats()
+
+    def stop(self) -> None:
+        """
+        Stops every shard and cancels pending restarts
+        """
+
+        self._pending.clear()
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for shard_id, process in enumerate(self._processes):
+            if process is not None:
+                process.join()
+                self.exit_codes[shard_id] = process.exitcode
+                self._processes[shard_id] = None
@@ -0,0 +1,58 @@
+import marshal
+import os
+import zlib
+
+# Bumped whenever the layout of the snapshot changes, older snapshots are ignored
+snapshot_version = 4
+snapshot_magic = b'CTFBOTSNAP'
+
+
+def write_snapshot(p: str, last_solve_id: int, events: dict) -> None:
+    """
+    Writes the snapshot of every event to the file `p`
+    The file is replaced at once, so a crash while writing leaves the previous snapshot in place
+
+    Parameters:
+    ----------
+    p: str
+        Path of the snapshot file
+    last_solve_id: int
+        ID of the newest solve that is part of the snapshot, see `Database.last_solve_id`
+    events: dict
+        Key is server id
+        Value is a dict with the `Event.snapshot` state of the event and the `stamp` of its challenge file
+    """
+
+    data = marshal.dumps({'version': snapshot_version, 'last_solve_id': last_solve_id, 'events': events})
+
+    tmp_p = p + '.tmp'
+    with open(tmp_p, 'wb') as file:
+        file.write(snapshot_magic)
+        file.write(zlib.compress(data, 1))
+    os.replace(tmp_p, p)
+
+
+def read_snapshot(p: str):
+    """
+    Returns a (last solve id, events) tuple of the snapshot file `p`, as written by `write_snapshot`
+    Returns None if there is no snapshot or it can not be used
+    """
+
+    try:
+        with open(p, 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+
+    if not data.startswith(snapshot_magic):
+        return None
+
+    try:
+        snapshot = marshal.loads(zlib.decompress(data[len(snapshot_magic):]))
+    except (zlib.error, ValueError, EOFError, TypeError) as e:
+        print('Invalid snapshot: {}'.format(e))
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get('version') != snapshot_version:
+        return None
+    return snapshot['last_solve_id'], snapshot['events']
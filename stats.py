@@ -0,0 +1,193 @@
+import bisect
+import os
+import time
+
+# Upper bounds, in seconds, of the latency histogram buckets
+latency_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram(object):
+    """
+    Class representing a fixed-bucket latency histogram
+
+    Attributes:
+    ----------
+    counts: list[int]
+        Number of observations of each bucket. The last bucket counts observations above every bound
+    total: float
+        Sum of all observations
+    count: int
+        Number of observations
+    """
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(latency_buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(latency_buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns the upper bound of the bucket that holds the `q` quantile, or None if nothing was observed
+        """
+
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(latency_buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class _Timer(object):
+    __slots__ = ('stats', 'server_id', 'stage', 'start')
+
+    def __init__(self, stats, server_id, stage):
+        self.stats = stats
+        self.server_id = server_id
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_traceback):
+        self.stats.observe(self.server_id, self.stage, time.perf_counter() - self.start)
+
+
+class Stats(object):
+    """
+    Per-server latency histograms and counters of the bot
+    Statistics that belong to no single server, e.g. submissions throttled before their server is known,
+    are kept under the server id `global_server_id`
+
+    Attributes:
+    ----------
+    histograms: dict
+        Key is a (server id, stage) tuple
+        Value is the `Histogram` of the stage
+    counters: dict
+        Key is a (server id, counter name) tuple
+        Value is the counter
+    """
+
+    global_server_id = ''
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def timer(self, server_id: str, stage: str) -> _Timer:
+        """
+        Returns a context manager that records the time spent in its body as a `stage` observation
+
+        Parameters:
+        ----------
+        server_id: str
+            ID of the server the work is done for
+        stage: str
+            Name of the stage
+        """
+
+        return _Timer(self, server_id, stage)
+
+    def observe(self, server_id: str, stage: str, seconds: float) -> None:
+        """
+        Records that `stage` took `seconds` seconds in the server with the id `server_id`
+        """
+
+        key = (server_id, stage)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(seconds)
+
+    def increment(self, server_id: str, name: str, amount: int = 1) -> None:
+        """
+        Adds `amount` to the counter `name` of the server with the id `server_id`
+        """
+
+        key = (server_id, name)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self, server_id: str) -> str:
+        """
+        Returns a human readable summary of the statistics of the server with the id `server_id`,
+        followed by the statistics that belong to no single server, which are marked with a *
+        """
+
+        def label(entry_server_id: str, name: str) -> tuple:
+            # Sorts the statistics of the server first
+            if entry_server_id == server_id:
+                return False, name
+            return True, '*' + name
+
+        shown = (server_id, self.global_server_id)
+        histograms = sorted(((label(entry_server_id, stage), histogram)
+                             for (entry_server_id, stage), histogram in self.histograms.items()
+                             if entry_server_id in shown), key=lambda item: item[0])
+        counters = sorted((label(entry_server_id, name), value)
+                          for (entry_server_id, name), value in self.counters.items() if entry_server_id in shown)
+
+        lines = ['```', '{:<24} {:>8} {:>10} {:>10} {:>10}'.format('stage', 'count', 'mean (ms)', 'p50 (ms)',
+                                                                    'p99 (ms)')]
+        for (_, stage), histogram in histograms:
+            lines.append('{:<24} {:>8} {:>10.2f} {:>10} {:>10}'.format(
+                stage, histogram.count, histogram.total / histogram.count * 1000,
+                self._format_bound(histogram.quantile(0.5)), self._format_bound(histogram.quantile(0.99))))
+
+        if counters:
+            lines.append('')
+            lines.extend('{}: {}'.format(name, value) for (_, name), value in counters)
+
+        if any(shared for (shared, _), _ in histograms + counters):
+            lines.append('')
+            lines.append('* not tied to a server, e.g. submissions throttled before their server is read')
+
+        lines.append('```')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _format_bound(bound: float) -> str:
+        return '<{:g}'.format(bound * 1000)
+
+    def export_prometheus(self, p: str) -> None:
+        """
+        Writes every histogram and counter to the file `p` in the Prometheus text format
+        The file is replaced at once, so a scraper never reads a partially written file
+        """
+
+        lines = ['# HELP ctfbot_stage_seconds Time spent in each stage of the bot',
+                 '# TYPE ctfbot_stage_seconds histogram']
+        for (server_id, stage), histogram in sorted(self.histograms.items(), key=self._sort_key):
+            labels = 'server="{}",stage="{}"'.format(server_id, stage)
+            cumulative = 0
+            for bound, count in zip(latency_buckets, histogram.counts):
+                cumulative += count
+                lines.append('ctfbot_stage_seconds_bucket{{{},le="{:g}"}} {}'.format(labels, bound, cumulative))
+            lines.append('ctfbot_stage_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, histogram.count))
+            lines.append('ctfbot_stage_seconds_sum{{{}}} {}'.format(labels, histogram.total))
+            lines.append('ctfbot_stage_seconds_count{{{}}} {}'.format(labels, histogram.count))
+
+        lines.append('# HELP ctfbot_events_total Number of times each event happened')
+        lines.append('# TYPE ctfbot_events_total counter')
+        for (server_id, name), value in sorted(self.counters.items(), key=self._sort_key):
+            lines.append('ctfbot_events_total{{server="{}",name="{}"}} {}'.format(server_id, name, value))
+
+        tmp_p = p + '.tmp'
+        with open(tmp_p, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(tmp_p, p)
+
+    @staticmethod
+    def _sort_key(item):
+        return item[0]
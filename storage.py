@@ -0,0 +1,167 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db_handler import Database
+
+
+class Storage(object):
+    """
+    Asynchronous facade over `Database` that keeps SQLite work off the event loop
+
+    Reads run on a small pool of threads, each with its own connection.
+    Writes run on a single writer thread, which executes every write waiting in its queue and commits them together,
+    so a burst of solves costs a single commit.
+    Every call returns a future. The future of a write is resolved only once the write is committed.
+
+    Attributes:
+    ----------
+    loop: `asyncio.AbstractEventLoop`
+        The loop the returned futures belong to
+    database_file: str
+        Name of the database file, see `Database`
+    batch_size: int
+        Maximum number of writes committed together
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, database_file='ctfbot.db', readers=2, batch_size=256):
+        self.loop = loop
+        self.database_file = database_file
+        self.batch_size = batch_size
+
+        self._readers = ThreadPoolExecutor(readers)
+        self._reader_local = threading.local()
+        self._reader_dbs = []
+        self._reader_dbs_lock = threading.Lock()
+
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name='storage-writer', daemon=True)
+        self._writer.start()
+
+        self.write(lambda db: db.check_create_tables())
+
+    def read(self, func) -> asyncio.Future:
+        """
+        Runs `func(db)` on a reader thread and returns a future of its result
+
+        Parameters:
+        ----------
+        func: Callable[[Database], Any]
+            Function that reads from the database. It must not write
+        """
+
+        return self.loop.run_in_executor(self._readers, self._read, func)
+
+    def write(self, func) -> asyncio.Future:
+        """
+        Runs `func(db)` on the writer thread and returns a future of its result,
+        which is resolved once the write is committed
+
+        Parameters:
+        ----------
+        func: Callable[[Database], Any]
+            Function that writes to the database. It must not commit, the writer commits every write of a batch
+            at once
+        """
+
+        future = self.loop.create_future()
+        self._writes.put((func, future))
+        return future
+
+    def add_solve(self, member_id: str, server_id: str, challenge_name: str, reward: int = 0,
+                  solved_at: float = None, reward_change: int = 0) -> asyncio.Future:
+        """
+        Saves a single solved challenge and its score, see `Database.insert_solve`
+        Returns a future that is resolved once the solve is committed
+        """
+
+        return self.write(lambda db: db.insert_solve(member_id, server_id, challenge_name, reward, solved_at,
+                                                     reward_change))
+
+    def log_submission(self, server_id: str, member_id: str, challenge_name: str, correct: bool,
+                       submitted_at: float) -> asyncio.Future:
+        """
+        Appends a checked flag to the submission log, see `Database.log_submission`
+        Returns a future that is resolved once the submission is committed
+        """
+
+        return self.write(lambda db: db.log_submission(server_id, member_id, challenge_name, correct, submitted_at))
+
+    def close(self) -> None:
+        """
+        Commits every queued write and closes all connections
+        """
+
+        self._writes.put(None)
+        self._writer.join()
+
+        self._readers.shutdown()
+        for db in self._reader_dbs:
+            db.close()
+
+    def _read(self, func):
+        db = getattr(self._reader_local, 'db', None)
+        if db is None:
+            # The connection is only used by this thread, but it is closed by `close`
+            db = Database(self.database_file).open(check_same_thread=False)
+            self._reader_local.db = db
+            with self._reader_dbs_lock:
+                self._reader_dbs.append(db)
+        try:
+            return func(db)
+        finally:
+            # A transaction left open would hold the reader on an old snapshot of the database for good
+            if db.connection.in_transaction:
+                db.connection.rollback()
+
+    def _resolve(self, future: asyncio.Future, result=None, exception=None) -> None:
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def _write_loop(self) -> None:
+        db = Database(self.database_file).open()
+
+        running = True
+        while running:
+            # Block for the first write, then take whatever else is already waiting
+            batch = [self._writes.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+
+            results = []
+            try:
+                # Take the write lock up front. A batch that reads before it writes would otherwise fail at once,
+                # without waiting for the busy timeout, once another process commits between its read and its write
+                if batch:
+                    db.cursor.execute('BEGIN IMMEDIATE')
+                for func, future in batch:
+                    # Every write runs in a savepoint, so a write that fails halfway leaves nothing behind
+                    # while the rest of the batch is still committed
+                    db.cursor.execute('SAVEPOINT write')
+                    try:
+                        results.append((future, func(db), None))
+                    except Exception as e:
+                        db.cursor.execute('ROLLBACK TO write')
+                        results.append((future, None, e))
+                    db.cursor.execute('RELEASE write')
+                db.connection.commit()
+            except Exception as e:
+                db.connection.rollback()
+                results = [(future, None, e) for _, future in batch]
+
+            for future, result, exception in results:
+                self.loop.call_soon_threadsafe(self._resolve, future, result, exception)
+
+        db.close()
@@ -0,0 +1,114 @@
+import time
+from collections import OrderedDict, deque
+
+
+class _Window(object):
+    __slots__ = ('hits',)
+
+    def __init__(self, limit: int):
+        self.hits = deque(maxlen=limit)
+
+
+class SlidingWindowLimiter(object):
+    """
+    Class that allows every key at most `limit` hits in any `window` seconds
+
+    Keys are kept in order of their last hit, so keys that have been idle for a whole window are dropped as soon as
+    newer keys are hit, and at most `max_keys` keys are remembered.
+
+    Attributes:
+    ----------
+    limit: int
+        Number of hits allowed in a window
+    window: float
+        Length of the window in seconds
+    max_keys: int
+        Maximum number of keys remembered
+    shed: int
+        Number of hits that were refused
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = 10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.shed = 0
+
+        self._windows = OrderedDict()
+        self._notified = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def allow(self, key, now: float = None) -> bool:
+        """
+        Records a hit of `key` and returns True, or returns False if `key` already used up its window
+
+        Parameters:
+        ----------
+        key: Hashable
+            The key that is hit, e.g. a member id
+        now: float
+            The current `time.monotonic()` time
+        """
+
+        if now is None:
+            now = time.monotonic()
+        start = now - self.window
+
+        self._expire(start)
+
+        window = self._windows.get(key)
+        if window is None:
+            window = _Window(self.limit)
+            self._windows[key] = window
+        else:
+            self._windows.move_to_end(key)
+
+        while window.hits and window.hits[0] <= start:
+            window.hits.popleft()
+
+        if len(window.hits) >= self.limit:
+            self.shed += 1
+            return False
+
+        window.hits.append(now)
+        return True
+
+    def notify(self, key, now: float = None) -> bool:
+        """
+        Returns True if `key` should be told it is throttled, that is at most once a window
+
+        Parameters:
+        ----------
+        key: Hashable
+            The key that was refused
+        now: float
+            The current `time.monotonic()` time
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        self._expire_notified(now - self.window)
+
+        if key in self._notified:
+            return False
+
+        self._notified[key] = now
+        return True
+
+    def _expire(self, start: float) -> None:
+        # The first key is the one hit longest ago
+        while self._windows:
+            window = next(iter(self._windows.values()))
+            if len(self._windows) < self.max_keys and window.hits and window.hits[-1] > start:
+                break
+            self._windows.popitem(last=False)
+
+    def _expire_notified(self, start: float) -> None:
+        while self._notified:
+            notified_at = next(iter(self._notified.values()))
+            if len(self._notified) < self.max_keys and notified_at > start:
+                break
+            self._notified.popitem(last=False)